@@ -1,141 +1,407 @@
 import numpy as np
-from queue import PriorityQueue
+import heapq
+import multiprocessing
+import queue
+import time
+import manifest
+try:
+    import resource # unix only, used to report peak memory
+except ImportError:
+    resource = None
+
+class Bay:
+    '''
+    geometry of a ship bay: rows x cols cells indexed row major from the bottom left, idx = (y-1)*cols + (x-1)
+    columns 1..keel are port and keel+1..cols starboard, and the crane parks at park = (y, x)
+    the per cell arrays below are shared by every layout of the bay so the kernels never rebuild them
+    '''
+    def __init__(self, rows: int = 8, cols: int = 12, keel: int = None, park: tuple = None):
+        self.rows = rows
+        self.cols = cols
+        self.cells = rows*cols
+        self.keel = keel if keel is not None else cols//2
+        self.park = park if park is not None else (rows + 1, 1)
+
+        self.x = np.tile(np.arange(1, cols + 1), rows) # column of every cell
+        self.port = self.x <= self.keel
+        self.side = np.where(self.port, 1, -1) # port minus starboard weight is weights @ side
+        # fewest columns a crate in each cell has to travel to get to the other side
+        self.keel_distance = np.where(self.port, self.keel + 1 - self.x, self.x - self.keel)
+
+        # zobrist table: one random 64 bit word per (cell, content id) pair
+        # content id 0 is an empty slot and NAN cells never move, so neither is ever xor'd in
+        self.zobrist = np.random.default_rng(179).integers(0, 2**63, size=(self.cells, self.cells + 1), dtype=np.uint64)
+
+    @classmethod
+    def from_manifest(cls, w: np.ndarray):
+        # the bay a manifest describes (w from manifest_arrays), it has to list every cell
+        rows, cols = int(w[:, 0].max()), int(w[:, 1].max())
+        if rows*cols != w.shape[0]:
+            raise ValueError("manifest lists " + str(w.shape[0]) + " cells, a " + str(rows) + "x" + str(cols) + " bay has " + str(rows*cols))
+        return BAY if (rows, cols) == (BAY.rows, BAY.cols) else cls(rows, cols)
+
+BAY = Bay() # the 8 x 12 bay of the sample ships
+
+def manifest_arrays(X: np.ndarray):
+    '''
+    goal: (w, is_crate, nan) of a manifest, w is the int64 y, x, weight of every cell
+    X is either the typed cells of manifest.parse or the all string array (y, x, weight, label) of np.loadtxt
+    '''
+    if X.dtype.names is not None:
+        w = np.column_stack((X['y'], X['x'], X['weight'])).astype(np.int64)
+        return w, X['label'] > manifest.UNUSED, X['label'] == manifest.NAN
+    label = X[:, 3]
+    return np.int64(X[:, 0:3]), (label != 'UNUSED') & (label != 'NAN'), label == 'NAN'
+
+def content_ids(w: np.ndarray, is_crate: np.ndarray):
+    '''
+    goal: give every distinct crate weight a small integer id, 0 for empty/NAN cells
+    balance and crane cost only depend on where weights sit, so crates of equal weight share an id
+    and layouts that only differ by swapping them are the same search state
+    '''
+    ids = np.zeros(is_crate.shape[0], dtype=np.int16)
+    if is_crate.any():
+        ids[is_crate] = np.unique(w[is_crate, 2], return_inverse=True)[1].ravel() + 1
+    return ids
 
-def imbalance_score(w):
-    mask = w[:, 1] <= 6
+def best_balance(weights: np.ndarray, port_slots: int, starboard_slots: int):
+    '''
+    goal: the smallest |port - starboard| that any arrangement of the crates can reach
+    subset sum over the crate weights with a python int as bitset (bit s set = some crates weigh s in total);
+    when one side cannot hold every crate the bitsets are kept per crate count so side capacity is respected
+    '''
+    weights = [int(weight) for weight in weights]
+    total = sum(weights)
+    n = len(weights)
+
+    if n <= min(port_slots, starboard_slots):
+        sums = 1
+        for weight in weights:
+            sums |= sums << weight
+    else:
+        # by_count[k] = bitset of port totals reachable with exactly k crates on port
+        by_count = [1] + [0]*n
+        for i, weight in enumerate(weights):
+            for k in range(i + 1, 0, -1):
+                by_count[k] |= by_count[k - 1] << weight
+        sums = 0
+        for k in range(max(0, n - starboard_slots), min(n, port_slots) + 1):
+            sums |= by_count[k]
+
+    if sums == 0:
+        return total # the crates do not fit at all, nothing to aim for
+
+    # reachable port totals closest to half the total from below and from above
+    half = total//2
+    best = total
+    below = sums & ((1 << (half + 1)) - 1)
+    if below:
+        best = min(best, total - 2*(below.bit_length() - 1))
+    above = sums >> half
+    if above:
+        best = min(best, abs(2*(half + (above & -above).bit_length() - 1) - total))
+    return best
+
+def rebuild_manifest(X: np.ndarray, actions: np.ndarray):
+    '''
+    goal: replay the crate moves of a plan on the parsed manifest so weights and labels end up in place
+    the search itself never tracks labels, only weights and occupancy, so this is only done once the final
+    plan is output (batch.py writes its OUTBOUND manifests from it)
+    X is either kind of manifest manifest_arrays takes, and the same kind is returned
+    '''
+    X = np.array(X) # a copy, also of a memory mapped manifest
+    y, x = manifest_arrays(X)[0][:, 0:2].T
+    # actions alternate crane repositioning and crate moves, starting and ending at the park cell
+    for action in actions[1::2]:
+        src = np.nonzero((y == action[0]) & (x == action[1]))[0]
+        dst = np.nonzero((y == action[2]) & (x == action[3]))[0]
+        if X.dtype.names is not None:
+            for field in ('weight', 'label'):
+                X[field][src], X[field][dst] = X[field][dst], X[field][src]
+        else:
+            X[src, 2:4], X[dst, 2:4] = X[dst, 2:4], X[src, 2:4]
+    return X
+
+def zobrist_key(ids: np.ndarray, bay: Bay = BAY):
+    occupied = ids.nonzero()[0]
+    if occupied.size == 0:
+        return 0
+    return int(np.bitwise_xor.reduce(bay.zobrist[occupied, ids[occupied]]))
+
+def imbalance_score(w, bay: Bay = BAY):
+    mask = w[:, 1] <= bay.keel
     return abs(np.sum(w[mask, 2]) - np.sum(w[~mask, 2]))    
 
 
-def heuristic(target_weight: int, node: object):
+def heuristic(tolerance: float, bay: Bay, weights: np.ndarray, is_crate: np.ndarray):
     '''
-    goal: find minimum number of crates it takes to fill up the lesser side to the target_weight
+    goal: admissible lower bound on the crane minutes left to bring the imbalance down to tolerance
+      - the net weight moved off the heavier side has to be at least (imbalance - tolerance)/2,
+        so at least as many crates as the fewest (heaviest) crates of that side that add up to it
+      - each of those crates has to cross the keel, which takes at least its column distance to the keel
+    weights and is_crate are K x cells, one row per layout, and h(n) of every layout is returned
     '''
-    w_mask = (node.label != 'UNUSED') & (node.label != 'NAN')
-    p_mask = node.w[:, 1] <= 6
+    weights = np.atleast_2d(weights)
+    is_crate = np.atleast_2d(is_crate)
+    balance = weights @ bay.side # port - starboard
+    need = (np.abs(balance) - tolerance)/2
 
-    # weights of each side P & S
-    p_weights = node.w[p_mask & w_mask, 2]
-    s_weights = node.w[~p_mask & w_mask, 2]
+    # every layout holds the same number of crates, so work on a K x crates block of their cells only
+    cell = np.nonzero(is_crate)[1].reshape(len(weights), -1)
+    if cell.shape[1] == 0:
+        return np.zeros(len(weights), dtype=np.int64)
+    crate_weights = np.take_along_axis(weights, cell, axis=1)
 
-    # each side total weight - ideal weight
-    p_diff = np.sum(p_weights) - target_weight
-    s_diff = np.sum(s_weights) - target_weight
+    # crates on the heavier side
+    heavy = bay.port[cell] == (balance > 0)[:, None]
+    n_heavy = np.count_nonzero(heavy, axis=1)
 
-    # picking which side receives weights
-    smaller_diff = None
-    bigger_weights = None
-    if p_diff <= s_diff: # heaviver side is S, moving to P
-        smaller_diff = abs(p_diff)
-        bigger_weights = s_weights
-    else:
-        smaller_diff = abs(s_diff)
-        bigger_weights = p_weights
-
-    # algorithm
-    sum_weight = 0 # to get to at least diff or greater
-    sum_count = 0
-    while sum_weight < smaller_diff:
-        # pick weight that fills nearly the same about as smaller difference from current to target weight
-        idx = np.argmin(np.abs(bigger_weights - smaller_diff))
-        weight = bigger_weights[idx]
-
-        sum_weight+=weight
-        sum_count+=1
-        # remove weight from heavier side
-        bigger_weights = np.delete(bigger_weights, idx, axis=0)
-    
-    return sum_count
+    # fewest crates whose weights add up to need: heaviest first until the running total gets there
+    heaviest = np.cumsum(-np.sort(-np.where(heavy, crate_weights, 0), axis=1), axis=1)
+    reached = heaviest >= need[:, None]
+    count = np.where(reached.any(axis=1), np.argmax(reached, axis=1) + 1, n_heavy)
+
+    # cheapest possible crossing of each of them: straight over to the nearest column on the other side
+    nearest = np.cumsum(np.sort(np.where(heavy, bay.keel_distance[cell], bay.cols), axis=1), axis=1)
+    h = np.where(count > 0, nearest[np.arange(len(count)), np.maximum(count - 1, 0)], 0)
+    return np.where(need > 0, h, 0)
 
-def terminal_graphic(node: object):
+def terminal_graphic(arena: object, row: int):
 
-    grid = np.empty(node.label.shape, dtype=object)
-    is_crate = (node.label != 'UNUSED') & (node.label != 'NAN')       
-    is_avail = (node.label != 'NAN') & ~is_crate
+    grid = np.empty(arena.ids.shape[1], dtype=object)
+    is_crate = arena.ids[row] != 0
+    is_avail = ~arena.nan & ~is_crate
 
     grid[is_crate] = 'c'
     grid[is_avail] = '_'
     grid[~is_crate & ~is_avail] = 'x'
 
-    grid = grid.reshape(8, 12)[::-1]
+    grid = grid.reshape(arena.bay.rows, arena.bay.cols)[::-1]
     
     return grid
     
         
+def column_profile(ids: np.ndarray, nan: np.ndarray, bay: Bay = BAY):
+    '''
+    goal: per column, the idx of the top crate and the idx of the first free slot (-1 if none)
+    '''
+    is_crate = (ids != 0).reshape(bay.rows, bay.cols)
+    is_avail = ((ids == 0) & ~nan).reshape(bay.rows, bay.cols)
+    cols = np.arange(bay.cols)
+
+    # highest crate row and lowest free row of each column
+    top_crate_row = bay.rows - 1 - np.argmax(is_crate[::-1], axis=0)
+    top_free_row = np.argmax(is_avail, axis=0)
+
+    top_crate = np.where(is_crate.any(axis=0), top_crate_row*bay.cols + cols, -1)
+    top_free = np.where(is_avail.any(axis=0), top_free_row*bay.cols + cols, -1)
+    return top_crate, top_free
+
+
+class NodeArena:
+    '''
+    struct of arrays node store: row i of every buffer belongs to one search node and parents are row numbers
+    layouts are kept as small integer content ids (weights are looked up in weight_of when needed) and the
+    move into a node as its (source, destination) cell idx, so a node costs ~150 bytes instead of a few kB
+    buffers double in size when full; truncate() drops rows from the end (used as a stack by ida_star)
+    '''
+    def __init__(self, w: np.ndarray, ids: np.ndarray, nan: np.ndarray, bay: Bay = BAY, capacity: int = 1024):
+        self.bay = bay
+        self.coords = w[:, 0:2] # y, x of every cell, the same for every node
+        self.nan = nan # True for NAN cells, the same for every node
+        # weight of every content id, id 0 is an empty/NAN cell
+        self.weight_of = np.zeros(int(ids.max()) + 1, dtype=np.int64)
+        self.weight_of[ids] = w[:, 2]
+        self.size = 0
+
+        cell = np.int8 if w.shape[0] < 128 else np.int16
+        content = np.int8 if len(self.weight_of) < 128 else np.int16
+        self.columns = {
+            'ids': ((w.shape[0],), content), # content id of every cell
+            'top_crate': ((bay.cols,), cell), # per column idx of the top crate, -1 if none
+            'top_free': ((bay.cols,), cell), # per column idx of the first free slot, -1 if none
+            'move': ((2,), cell), # (source, destination) cell idx of the crate move into the node
+            'parent': ((), np.int32), # row of the parent, -1 for the start
+            'key': ((), np.uint64), # zobrist key of the layout
+            'g': ((), np.int32), # crate move minutes so far
+            'h': ((), np.int32), # heuristic
+            'cost': ((), np.int32), # minutes of the move into the node
+            'score': ((), np.int32), # |port - starboard|
+            'depth': ((), np.int16), # crate moves so far
+        }
+        for name, (shape, dtype) in self.columns.items():
+            setattr(self, name, np.zeros((capacity,) + shape, dtype=dtype))
+
+    def add(self, **values: np.ndarray):
+        # append len(values) rows, every column must be given; returns the new row numbers
+        count = len(values['g'])
+        while self.size + count > len(self.g):
+            for name in self.columns:
+                buffer = getattr(self, name)
+                grown = np.zeros((2*len(buffer),) + buffer.shape[1:], dtype=buffer.dtype)
+                grown[:self.size] = buffer[:self.size]
+                setattr(self, name, grown)
+        rows = np.arange(self.size, self.size + count)
+        for name in self.columns:
+            getattr(self, name)[rows] = values[name]
+        self.size += count
+        return rows
+
+    def truncate(self, size: int):
+        self.size = size
+
+    def weights(self, row: int):
+        return self.weight_of[self.ids[row]]
+
+    def action(self, row: int):
+        # [y1, x1, y2, x2] of the crate move into row
+        src, dst = self.move[row]
+        return np.concatenate((self.coords[src], self.coords[dst]))
+
+    def path(self, row: int):
+        # rows from row back up to the start
+        rows = []
+        while row >= 0:
+            rows.append(row)
+            row = int(self.parent[row])
+        return rows
+
+    def nbytes(self):
+        return sum(getattr(self, name)[:self.size].nbytes for name in self.columns)
+
+
 # return possible neighbors of node
-def neighbors(node: object):
-    is_crate = (node.label != 'UNUSED') & (node.label != 'NAN')       
-    is_avail = (node.label != 'NAN') & ~is_crate
-
-    idx_top_avail_list = []
-    idx_top_crates_list = []
-    # in each col
-    for col in range(1, 13):
-        is_col = node.w[:, 1] == col
-        idx_crates = (is_col & is_crate).nonzero()[0] # idx of each crate
-        idx_top_avail = (is_col & is_avail).nonzero()[0]# idx of available spot
-        
-        if idx_crates.size != 0:
-            idx_top_crates_list.append(idx_crates[-1])
-        if idx_top_avail.size !=0:
-            idx_top_avail_list.append(idx_top_avail[0])
-        
-    
-    top_avail = np.vstack(idx_top_avail_list).ravel()
-    top_crates = np.vstack(idx_top_crates_list).ravel()
+# every child is built as one row of a K x cells block so costs, keys, profiles and scores
+# are computed for the whole batch at once, and only children that survive the
+# closed set and open_cost filters are added to the arena
+def neighbors(arena: object, row: int, tolerance: float, closed: set = None, open_cost: dict = None,
+              prune: bool = True, stats: dict = None):
+    closed = closed if closed is not None else set()
+    open_cost = open_cost if open_cost is not None else {}
+    bay = arena.bay
+    parent_ids = arena.ids[row].astype(np.intp)
+    parent_top_crate = arena.top_crate[row]
+    parent_top_free = arena.top_free[row]
+    top_crates = parent_top_crate[parent_top_crate >= 0]
+    top_avail = parent_top_free[parent_top_free >= 0]
+
+    # every (crate, spot) pair in different columns, crate major like the old nested loops
+    src = np.repeat(top_crates, top_avail.size).astype(np.intp)
+    dst = np.tile(top_avail, top_crates.size).astype(np.intp)
+    diff_col = (src % bay.cols) != (dst % bay.cols)
+    src, dst = src[diff_col], dst[diff_col]
+
+    if prune and arena.parent[row] >= 0:
+        keep = ~pruned_moves(arena.move[row], src, dst, bay.cols)
+        if stats is not None:
+            stats['pruned'] = stats.get('pruned', 0) + int(src.size - np.count_nonzero(keep))
+        src, dst = src[keep], dst[keep]
+
+    if src.size == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # only the two swapped cells change, so patch the parent key instead of rehashing
+    crate_ids = parent_ids[src]
+    keys = arena.key[row] ^ bay.zobrist[src, crate_ids] ^ bay.zobrist[dst, crate_ids]
+
+    # crane minutes of each move, measured on the parent layout
+    span = range_max_table(column_heights(parent_top_free, bay))
+    costs = move_costs(span, arena.coords[src, 0], arena.coords[src, 1], arena.coords[dst, 0], arena.coords[dst, 1])
+    gns = int(arena.g[row]) + costs
+    depth = int(arena.depth[row]) + 1
+
+    # drop children that are already expanded or already queued at no greater cost (minutes, then moves)
+    survivors = [i for i, (key, gn) in enumerate(zip(keys.tolist(), gns.tolist()))
+                 if key not in closed and (key not in open_cost or (gn, depth) < open_cost[key])]
+    if len(survivors) == 0:
+        return np.zeros(0, dtype=np.intp)
+    src, dst, keys, costs, gns = src[survivors], dst[survivors], keys[survivors], costs[survivors], gns[survivors]
+    k = np.arange(src.size)
+
+    # K x cells child layouts: the crate's id moves from src to dst
+    ids = np.repeat(parent_ids[None], src.size, axis=0)
+    ids[k, dst] = ids[k, src]
+    ids[k, src] = 0
+    weights = arena.weight_of[ids]
+    is_crate = ids != 0
+
+    # port minus starboard weight of every child at once
+    scores = np.abs(weights @ bay.side)
+
+    # only the source and destination columns change height
+    col_src, col_dst = src % bay.cols, dst % bay.cols
+    below = src - bay.cols
+    has_below = (below >= 0) & ~arena.nan[np.maximum(below, 0)]
+    top_crate = np.repeat(parent_top_crate[None], src.size, axis=0)
+    top_free = np.repeat(parent_top_free[None], src.size, axis=0)
+    top_crate[k, col_src] = np.where(has_below, below, -1)
+    top_free[k, col_src] = src
+    top_crate[k, col_dst] = dst
+    top_free[k, col_dst] = np.where(dst + bay.cols < bay.cells, dst + bay.cols, -1)
+
+    hns = heuristic(tolerance, bay, weights, is_crate)
+
+    return arena.add(ids=ids, top_crate=top_crate, top_free=top_free, move=np.column_stack((src, dst)),
+                     parent=np.full(src.size, row), key=keys, g=gns, h=hns, cost=costs, score=scores,
+                     depth=np.full(src.size, depth))
+
+def pruned_moves(last_move: np.ndarray, src: np.ndarray, dst: np.ndarray, cols: int = 12):
+    '''
+    goal: mask of moves that can be skipped after last_move (source, destination cell idx) without losing the optimal plan
+      - undo: moving the crate that was just moved straight back, which rebuilds the grandparent
+      - commutative duplicates: a move that does not touch the last move's columns and does not
+        cross them (and is not crossed by it) costs the same in either order and reaches the same
+        layout, so only the order with the smaller source column first is kept
+    '''
+    last_src, last_dst = int(last_move[0]), int(last_move[1])
+    undo = (src == last_dst) & (dst == last_src)
 
-    neighbors_list = []
-    for idx_crate in top_crates:
-        crate = node.w[idx_crate]
-        col_num = crate[1]
-        
-        for idx_spot in top_avail: 
-            spot = node.w[idx_spot] 
-            if spot[1] == crate[1]: continue
-            # create attributes
-            action = np.array([crate[0], crate[1], spot[0], spot[1]])
-            w = node.w.copy()
-            label = node.label.copy()
-            # swap
-            w[[idx_crate, idx_spot], 2] = w[[idx_spot, idx_crate], 2]
-            label[[idx_crate, idx_spot]] = label[[idx_spot, idx_crate]]
-           
-            neighbors_list.append(Node(w, label, action, node))
-        
-    return neighbors_list # consider adding top limit 
+    src_col, dst_col = src % cols, dst % cols
+    last_lo, last_hi = sorted((last_src % cols, last_dst % cols))
+    lo, hi = np.minimum(src_col, dst_col), np.maximum(src_col, dst_col)
+
+    def crosses(cols, a, b):
+        return (cols > a) & (cols < b)
+
+    disjoint = (src_col != last_lo) & (src_col != last_hi) & (dst_col != last_lo) & (dst_col != last_hi)
+    independent = (disjoint
+                   & ~crosses(src_col, last_lo, last_hi) & ~crosses(dst_col, last_lo, last_hi)
+                   & ~crosses(last_lo, lo, hi) & ~crosses(last_hi, lo, hi))
+    out_of_order = independent & (src_col < last_src % cols)
+
+    return undo | out_of_order
 
-def optimal_path(node: object):
-    anchor = node
+def optimal_path(arena: object, row: int):
+    rows = arena.path(row)[:-1] # goal first, the start has no move
     actions = []
-    nodes = []
     action_cost_list = []
     total_cost = 0
 
-    parked = [9, 1]
-    crane_action = np.array([node.action[2], node.action[3], parked[0], parked[1]])
+    parked = arena.bay.park
+    last_action = arena.action(rows[0])
+    crane_action = np.array([last_action[2], last_action[3], parked[0], parked[1]])
     actions.append(crane_action)
     action_cost = np.abs(crane_action[0] - crane_action[2]) + np.abs(crane_action[1] - crane_action[3])
     action_cost_list.append(action_cost)
     total_cost += action_cost
 
-    while anchor.parent is not None:
-        if len(nodes) != 0:
-            prev_node = nodes[-1]
-            prev_action = prev_node.action
-            crane_action = np.array([anchor.action[2], anchor.action[3], prev_action[0], prev_action[1]])
+    for i, anchor in enumerate(rows):
+        anchor_action = arena.action(anchor)
+        if i != 0:
+            prev_row = rows[i - 1]
+            prev_action = arena.action(prev_row)
+            crane_action = np.array([anchor_action[2], anchor_action[3], prev_action[0], prev_action[1]])
             actions.append(crane_action)
-            action_cost = g_cost(prev_node, crane_action)
+            action_cost = g_cost(arena, prev_row, crane_action)
             action_cost_list.append(action_cost)
             total_cost += action_cost
             
-        actions.append(anchor.action)
-        action_cost_list.append(anchor.cost)
-        total_cost += anchor.cost
-
-        nodes.append(anchor)
-        anchor = anchor.parent
+        actions.append(anchor_action)
+        action_cost_list.append(int(arena.cost[anchor]))
+        total_cost += int(arena.cost[anchor])
     
-    prev_node = nodes[-1]
-    crane_action = np.array([parked[0], parked[1], prev_node.action[0], prev_node.action[1]])
+    first_action = arena.action(rows[-1])
+    crane_action = np.array([parked[0], parked[1], first_action[0], first_action[1]])
     actions.append(crane_action)
     action_cost = np.abs(crane_action[0] - crane_action[2]) + np.abs(crane_action[1] - crane_action[3])
     action_cost_list.append(action_cost)
@@ -143,117 +409,503 @@ def optimal_path(node: object):
 
     return np.vstack(actions)[::-1], total_cost, np.vstack(action_cost_list)[::-1].ravel()
 
-def g_cost(node: object, action: np.ndarray):
-    objects = node.label != 'UNUSED'
-    widths = np.sort(action[[1, 3]])
-    heights = action[[0, 2]]
+def column_heights(top_free: np.ndarray, bay: Bay = BAY):
+    # highest occupied row (crate or NAN) of each column, bay.rows if the column is full
+    return np.where(top_free >= 0, top_free // bay.cols, bay.rows)
 
-    bounds = (node.w[:, 1] > widths[0]) & (node.w[:, 1] < widths[1])
-    area = node.w[objects & bounds]
+def range_max_table(heights: np.ndarray):
+    '''
+    goal: sparse table over column heights so the max over any column range is O(1)
+    row k holds the max of the 2^k columns starting at each column
+    '''
+    table = [heights]
+    span = 1
+    while span*2 <= heights.size:
+        level = table[-1].copy()
+        level[:-span] = np.maximum(table[-1][:-span], table[-1][span:])
+        table.append(level)
+        span *= 2
+    return np.vstack(table)
+
+def range_max(table: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+    # max height over 0 indexed columns lo..hi inclusive, 0 for an empty range
+    length = np.maximum(hi - lo + 1, 1)
+    level = np.log2(length).astype(np.intp)
+    lo_c = np.clip(lo, 0, table.shape[1] - 1)
+    hi_c = np.clip(hi - (1 << level) + 1, 0, table.shape[1] - 1)
+    return np.where(hi >= lo, np.maximum(table[level, lo_c], table[level, hi_c]), 0)
+
+def move_costs(span: np.ndarray, y1: np.ndarray, x1: np.ndarray, y2: np.ndarray, x2: np.ndarray):
+    '''
+    goal: crane minutes of a batch of moves on a layout, given the range max table of its column heights
+    '''
+    lo, hi = np.minimum(x1, x2), np.maximum(x1, x2)
 
-    in_between_height = 0
-    if area.size != 0:
-        in_between_height = np.max(area[:, 0])
+    # tallest stack strictly between the two columns (1 indexed lo+1..hi-1 is 0 indexed lo..hi-2)
+    in_between_height = range_max(span, lo, hi - 2)
 
-    total_cost = 0
-    if (heights[0] <= in_between_height) & (heights[1] <= in_between_height):
-        # print('hill')
-        total_cost += np.sum(np.abs(heights - in_between_height) + 1)
-    else:
-        # print('norm')
-        total_cost += np.abs(np.diff(heights)).item()
+    # 'hill': both ends are at or below the tallest stack, so go over it, otherwise straight across
+    hill = (y1 <= in_between_height) & (y2 <= in_between_height)
+    total_cost = np.where(hill, (in_between_height - y1 + 1) + (in_between_height - y2 + 1), np.abs(y1 - y2))
 
-    total_cost += np.abs(np.diff(widths)).item()
+    return total_cost + hi - lo
 
-    return total_cost
+def g_cost(arena: object, row: int, action: np.ndarray):
+    span = range_max_table(column_heights(arena.top_free[row], arena.bay))
+    y1, x1, y2, x2 = (np.array([v]) for v in action)
+    return int(move_costs(span, y1, x1, y2, x2)[0])
 
-        
-class Node:
-    def __init__(self, w: np.ndarray, label: np.ndarray, action: np.ndarray, parent: object):
-        self.w = w # 96 by 3 where cols= y, x, weight --> represent 8 x 12 grid
-        self.label = label # vector length 96 --> represent each label on 8 x12 grid
-        self.action = action # vector of [y1, x1, y2, x2] (the action it took to get to the node)
-        self.parent = parent # the node in which it came from 
-        self.cost = g_cost(parent, action) if action is not None else 0 # fix this later
-        self.gn = parent.gn + self.cost if parent is not None else self.cost
-        self.hn = heuristic(np.sum(w[:, 2])/2, self)
-        self.fn = self.gn + self.hn
-        self.score = imbalance_score(w)
-
-
-    def __eq__(self, other: object):
-        return np.array_equal(self.w, other.w) and np.array_equal(self.label, other.label)
-
-    def __lt__(self, other):
-        return self.score <= other.score
-    
-    def __hash__(self):
-        self.w.flags.writeable = False
-        self.label.flags.writeable = False
-        return hash((self.w.tobytes(), self.label.tobytes()))
 
+class HeapOpenList:
+    '''
+    binary heap open list of arena rows ordered on (f(n), crate moves so far, h(n), insertion order)
+    with weight != 1 it orders on g(n) + weight*h(n) instead (weighted A*)
+    '''
+    def __init__(self, weight: float = 1):
+        self.heap = []
+        self.count = 0
+        self.weight = weight
+
+    def put(self, row: int, g: int, h: int, depth: int):
+        heapq.heappush(self.heap, (g + self.weight*h, depth, h, self.count, row))
+        self.count += 1
 
-def a_star(X : np.ndarray):
-    # ds & init
-    open = PriorityQueue()
-    closed = set()
+    def get(self):
+        return heapq.heappop(self.heap)[-1]
+
+    def empty(self):
+        return len(self.heap) == 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return (entry[-1] for entry in self.heap)
 
-    start = Node(np.int64(X[:, 0:3]), X[:, 3], None, None) 
-    open.put((0, start))
-    open_cost = {start: 0}
+
+class BucketOpenList:
+    '''
+    dial bucket queue of arena rows for integer f(n): bucket f holds a small heap on (crate moves so far, h(n), insertion order)
+    stale entries are left in place and skipped by a_star when popped (lazy deletion)
+    '''
+    def __init__(self, weight: float = 1):
+        self.buckets = []
+        self.cursor = 0 # lowest bucket that may be non empty
+        self.size = 0
+        self.count = 0
+        self.weight = weight # g(n) + weight*h(n) is rounded down to its bucket
+
+    def put(self, row: int, g: int, h: int, depth: int):
+        f = int(g + self.weight*h)
+        while len(self.buckets) <= f:
+            self.buckets.append([])
+        heapq.heappush(self.buckets[f], (depth, h, self.count, row))
+        # with weight 1 and the consistent heuristic f never drops below the cursor (a_star's closed set
+        # without reopening relies on that), this only guards weighted and anytime searches
+        self.cursor = min(self.cursor, f)
+        self.count += 1
+        self.size += 1
+
+    def get(self):
+        while len(self.buckets[self.cursor]) == 0:
+            self.cursor += 1
+        self.size -= 1
+        return heapq.heappop(self.buckets[self.cursor])[-1]
+
+    def empty(self):
+        return self.size == 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (entry[-1] for bucket in self.buckets for entry in bucket)
+
+
+OPEN_LISTS = {'bucket': BucketOpenList, 'heap': HeapOpenList}
+
+def push_rows(open: object, arena: object, rows: np.ndarray, open_cost: dict):
+    # queue new arena rows and record their (g(n), crate moves) per zobrist key
+    for row, key, g, h, depth in zip(rows.tolist(), arena.key[rows].tolist(), arena.g[rows].tolist(),
+                                     arena.h[rows].tolist(), arena.depth[rows].tolist()):
+        open.put(row, g, h, depth)
+        open_cost[key] = (g, depth)
+
+class Progress:
+    '''
+    calls callback(report) at most once every interval seconds while a search runs, report is a dict with
+    'expanded', 'open' (open list size), 'best_f' (f(n) of the node just popped), 'best_imbalance'
+    (smallest |port - starboard| popped so far), 'seconds' and 'plan_cost' (crate move minutes of the
+    best plan found so far, None until there is one)
+    '''
+    def __init__(self, callback: object, interval: float = 1.0):
+        self.callback = callback
+        self.interval = interval
+        self.begin = time.perf_counter()
+        self.next_report = self.begin
+        self.best_imbalance = None
+
+    def update(self, arena: object, row: int, open: object, stats: dict, plan_cost: int = None):
+        score = int(arena.score[row])
+        if self.best_imbalance is None or score < self.best_imbalance:
+            self.best_imbalance = score
+        now = time.perf_counter()
+        if now < self.next_report:
+            return
+        self.next_report = now + self.interval
+        self.callback({'expanded': stats['expanded'], 'open': len(open), 'best_f': int(arena.g[row] + arena.h[row]),
+                       'best_imbalance': self.best_imbalance, 'seconds': now - self.begin, 'plan_cost': plan_cost})
+
+def start_node(X: np.ndarray, stats: dict, bay: Bay = None):
+    '''
+    goal: build the arena of a parsed manifest with the start node in row 0, and the imbalance tolerance
+    that counts as balanced
+    bay defaults to the one the manifest describes (see Bay.from_manifest)
+    '''
+    w, is_crate, nan = manifest_arrays(X)
+    bay = bay if bay is not None else Bay.from_manifest(w)
+    ids = content_ids(w, is_crate)
 
     # set goal
-    total_weight = np.sum(start.w[:, 2])
-    target_weight = total_weight/2
-    w_mask = (start.label != 'UNUSED') & (start.label != 'NAN')
-    weights = np.sort(start.w[w_mask, 2])
+    total_weight = np.sum(w[:, 2])
+    w_mask = ids != 0
+    weights = np.sort(w[w_mask, 2])
 
     min_local = round(total_weight*0.10, 2)
-    min_global = 0
-    if weights.size != 0:
-        if X.shape[0] % 2 == 0:
-            min_global = np.diff(np.unique(weights)[0:2]).item() 
-        else: 
-            min_global = weights[0]
+    # legal balance is within 10% of the total, if no arrangement gets there settle for the best one that exists
+    p_mask = w[:, 1] <= bay.keel
+    min_global = best_balance(weights, np.count_nonzero(p_mask & ~nan), np.count_nonzero(~p_mask & ~nan))
+    tolerance = max(min_global, min_local) # any layout at or under this imbalance is a goal
+    stats['best_balance'] = min_global
+
+    arena = NodeArena(w, ids, nan, bay)
+    top_crate, top_free = column_profile(ids, nan, bay)
+    arena.add(ids=ids[None], top_crate=top_crate[None], top_free=top_free[None], move=np.zeros((1, 2)),
+              parent=[-1], key=[zobrist_key(ids, bay)], g=[0], h=heuristic(tolerance, bay, w[:, 2], w_mask),
+              cost=[0], score=[imbalance_score(w, bay)], depth=[0])
+    return arena, tolerance
+
+def a_star(X : np.ndarray, open_list: str = 'bucket', prune: bool = True, stats: dict = None, weight: float = 1,
+           progress: object = None, interval: float = 1.0, bay: Bay = None):
+    '''
+    open_list: 'bucket' or 'heap' (see OPEN_LISTS)
+    prune: skip undo moves and duplicate orderings of independent moves, turn off to verify plans
+    stats: optional dict that is filled with search counters ('expanded', 'generated', 'pruned', 'arena_bytes')
+    weight: order the open list on g(n) + weight*h(n), 0 is uniform cost search and > 1 is weighted A*
+    progress: optional callable that gets a progress report every interval seconds (see Progress)
+    bay: geometry of the ship, by default the one the manifest describes
+    '''
+    stats = stats if stats is not None else {}
+    stats.update(expanded=0, generated=0, pruned=0)
+    reporter = Progress(progress, interval) if progress is not None else None
+
+    # ds & init
+    open = OPEN_LISTS[open_list](weight)
+    closed = set()
+
+    arena, tolerance = start_node(X, stats, bay)
+    open_cost = {}
+    push_rows(open, arena, np.arange(1), open_cost) # zobrist key -> best (g(n), crate moves) queued so far
 
     # begin
     while not open.empty():
 
-        fn, node = open.get()
+        row = open.get()
+        key = int(arena.key[row])
                 
-        if node in closed:
+        # skip entries that were expanded or re-queued at a lower g(n) after being pushed
+        if key in closed or (int(arena.g[row]), int(arena.depth[row])) > open_cost[key]:
             continue
 
-        if (node.score <= min_global) or (node.score <= min_local):
-            if node == start:
+        if reporter is not None:
+            reporter.update(arena, row, open, stats)
+
+        if arena.score[row] <= tolerance:
+            stats['arena_bytes'] = arena.nbytes()
+            if row == 0:
                 return np.array([]), 0, np.array([])
-            # print('g(n) =', node.gn,'h(n) =', node.hn, 'f(n) =', node.fn)
-            # print('balance_score:', node.score)
-            # print('action:', node.action, 'cost:', node.cost)
-            # print(terminal_graphic(node))
-            return optimal_path(node)
-
-        closed.add(node)
-
-        for child in neighbors(node):
-            if child not in open_cost:
-                open.put((child.fn, child))
-                open_cost[child] = child.fn
-            else:
-                if child.fn < open_cost[child]:
-                    open.put((child.fn, child))
-                    open_cost[child] = child.fn
+            # print('g(n) =', arena.g[row],'h(n) =', arena.h[row])
+            # print('balance_score:', arena.score[row])
+            # print(terminal_graphic(arena, row))
+            return optimal_path(arena, row)
+
+        closed.add(key)
+        stats['expanded'] += 1
+
+        # h(n) only depends on the layout, so comparing g(n) per key is the same as comparing f(n)
+        rows = neighbors(arena, row, tolerance, closed, open_cost, prune, stats)
+        push_rows(open, arena, rows, open_cost)
+        stats['generated'] += len(rows)
 
     # print('path not found.')
-    
+
+ANYTIME_WEIGHTS = (5, 3, 2, 1.5, 1.25, 1)
+
+def beats(arena: object, row: int, best: int):
+    # can row still lead to a plan better than best: fewer minutes, or as many minutes in fewer moves
+    f = arena.g[row] + arena.h[row]
+    return f < arena.g[best] or (f == arena.g[best] and arena.depth[row] < arena.depth[best])
+
+def anytime_a_star(X: np.ndarray, budget: float = None, weights: tuple = ANYTIME_WEIGHTS, open_list: str = 'heap',
+                   prune: bool = True, stats: dict = None, progress: object = None, interval: float = 1.0,
+                   bay: Bay = None):
+    '''
+    goal: anytime weighted A*, best plan found within budget seconds plus a proven suboptimality bound
+    the search starts greedy (large weight on h(n)) and lowers the weight after every plan it finds,
+    reusing the same open list; nodes are reopened when reached with a lower g(n) and anything that
+    cannot beat the current plan is pruned. once the weight is 1 and the open list runs dry the plan is optimal
+    the first plan is always returned even if it takes longer than the budget
+    stats also gets 'bound' (plan minutes / best lower bound, 1.0 when proven optimal) and 'weight'
+    progress works as in a_star, 'plan_cost' tells whether there is a plan to cut over to yet
+    '''
+    deadline = time.perf_counter() + budget if budget is not None else None
+    stats = stats if stats is not None else {}
+    stats.update(expanded=0, generated=0, pruned=0)
+    reporter = Progress(progress, interval) if progress is not None else None
+
+    arena, tolerance = start_node(X, stats, bay)
+    if arena.score[0] <= tolerance:
+        stats.update(bound=1.0, weight=1)
+        return np.array([]), 0, np.array([])
+
+    def live(row):
+        # not superseded by a cheaper copy of the same layout
+        return (int(arena.g[row]), int(arena.depth[row])) <= open_cost[int(arena.key[row])]
+
+    open = OPEN_LISTS[open_list](weights[0])
+    open_cost = {} # zobrist key -> best (g(n), crate moves) queued so far
+    push_rows(open, arena, np.arange(1), open_cost)
+    best = None # row of the best goal found so far
+
+    for weight in weights:
+        stats['weight'] = weight
+        if weight != open.weight:
+            # reorder what is left of the open list for the new weight
+            reordered = OPEN_LISTS[open_list](weight)
+            for row in open:
+                if live(row):
+                    reordered.put(row, int(arena.g[row]), int(arena.h[row]), int(arena.depth[row]))
+            open = reordered
+
+        while not open.empty():
+            if best is not None and deadline is not None and time.perf_counter() > deadline:
+                break
+
+            row = open.get()
+            if not live(row):
+                continue
+            # h(n) is admissible, so this node cannot lead to a cheaper plan (or an equally cheap one with fewer moves)
+            if best is not None and not beats(arena, row, best):
+                continue
+            if reporter is not None:
+                reporter.update(arena, row, open, stats, int(arena.g[best]) if best is not None else None)
+
+            if arena.score[row] <= tolerance:
+                best = row
+                # lower the weight and look for a better plan, at the last weight keep going until nothing beats it
+                if weight != weights[-1]:
+                    break
+                continue
+
+            stats['expanded'] += 1
+            # no closed set: open_cost only lets a layout back in with a lower g(n) (or as low in fewer moves), which reopens it
+            rows = neighbors(arena, row, tolerance, set(), open_cost, prune, stats)
+            if best is not None:
+                rows = rows[[beats(arena, child, best) for child in rows.tolist()]]
+            push_rows(open, arena, rows, open_cost)
+            stats['generated'] += len(rows)
+
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+
+    if best is None:
+        return # path not found
+
+    # lower bound on the optimal plan: the smallest f(n) still waiting, or the plan itself if nothing is
+    waiting = [int(arena.g[row] + arena.h[row]) for row in open if live(row)]
+    lower = min([f for f in waiting if f < arena.g[best]] + [int(arena.g[best])])
+    stats['bound'] = int(arena.g[best])/lower if lower > 0 else 1.0
+    stats['arena_bytes'] = arena.nbytes()
+    return optimal_path(arena, best)
+
+def beam_search(X: np.ndarray, width: int = 64, prune: bool = True, stats: dict = None, bay: Bay = None):
+    '''
+    goal: fast plan with no optimality guarantee, keep only the width best nodes (by f(n)) of every depth
+    '''
+    stats = stats if stats is not None else {}
+    stats.update(expanded=0, generated=0, pruned=0)
+
+    arena, tolerance = start_node(X, stats, bay)
+    if arena.score[0] <= tolerance:
+        return np.array([]), 0, np.array([])
+
+    seen = {int(arena.key[0])}
+    layer = [0]
+    while len(layer) != 0:
+        children = {} # zobrist key -> cheapest child row with that layout in this layer
+        for row in layer:
+            stats['expanded'] += 1
+            for child in neighbors(arena, row, tolerance, seen, None, prune, stats).tolist():
+                key = int(arena.key[child])
+                if key not in children or arena.g[child] < arena.g[children[key]]:
+                    children[key] = child
+        stats['generated'] += len(children)
+
+        goals = [child for child in children.values() if arena.score[child] <= tolerance]
+        if len(goals) != 0:
+            return optimal_path(arena, min(goals, key=lambda child: arena.g[child]))
+
+        layer = sorted(children.values(), key=lambda child: (arena.g[child] + arena.h[child], arena.h[child]))[:width]
+        seen.update(int(arena.key[child]) for child in layer)
+
+    # print('path not found.')
+
+def ida_star(X: np.ndarray, table_size: int = 1000000, prune: bool = True, stats: dict = None, bay: Bay = None):
+    '''
+    goal: memory bounded exact search for manifests whose open/closed sets would not fit in memory
+    iterative deepening on f(n): only the current path (the arena is used as a stack) and a transposition
+    table of at most table_size layouts are kept; once the table is full, layouts are simply searched again
+    instead of being stored
+    stats also gets 'iterations', 'peak_table' (largest table size) and 'peak_rss_kb' (unix only)
+    '''
+    stats = stats if stats is not None else {}
+    stats.update(expanded=0, generated=0, pruned=0, iterations=0, peak_table=0)
+
+    arena, tolerance = start_node(X, stats, bay)
+    if arena.score[0] <= tolerance:
+        return np.array([]), 0, np.array([])
+
+    threshold = int(arena.g[0] + arena.h[0])
+    while threshold < float('inf'):
+        stats['iterations'] += 1
+        table = {int(arena.key[0]): (0, 0)} # zobrist key -> best (g(n), crate moves) seen in this iteration
+        found = [] # (crate moves, plan) of the goal with the fewest moves found in this iteration
+        threshold = ida_search(arena, 0, threshold, tolerance, table, table_size, found, prune, stats)
+        stats['peak_table'] = max(stats['peak_table'], len(table))
+        stats['peak_rss_kb'] = peak_rss_kb()
+        if len(found) != 0:
+            return found[0][1]
+
+    # print('path not found.')
+
+def ida_search(arena: object, row: int, threshold: float, tolerance: float, table: dict, table_size: int, found: list,
+               prune: bool, stats: dict):
+    # depth first below threshold, returns the smallest f(n) that went over threshold
+    # a goal here has the fewest minutes (f(n) went up one threshold at a time), the rest of the
+    # iteration only looks for a goal with as many minutes in fewer moves
+    stats['expanded'] += 1
+    over = float('inf')
+
+    # the table stands in for open_cost, so layouts already reached as cheaply are skipped
+    mark = arena.size
+    children = neighbors(arena, row, tolerance, None, table, prune, stats).tolist()
+    for child in sorted(children, key=lambda child: (arena.g[child] + arena.h[child], arena.h[child])):
+        f = int(arena.g[child] + arena.h[child])
+        depth = int(arena.depth[child])
+        if f > threshold:
+            over = min(over, f)
+            continue
+        if len(found) != 0 and depth >= found[0][0]:
+            continue
+        if len(table) < table_size:
+            table[int(arena.key[child])] = (int(arena.g[child]), depth)
+        stats['generated'] += 1
+
+        if arena.score[child] <= tolerance:
+            # the rows below mark are reused once this call returns, so build the plan now
+            found[:] = [(depth, optimal_path(arena, child))]
+            continue
+
+        over = min(over, ida_search(arena, child, threshold, tolerance, table, table_size, found, prune, stats))
+
+    arena.truncate(mark)
+    return over
+
+def peak_rss_kb():
+    # peak resident memory of this process (kilobytes on linux), None where it cannot be read
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# name -> (solver, keyword arguments, suboptimality it guarantees)
+# the anytime solver reports its own bound in stats['bound'] which is used instead when present
+PORTFOLIO = {
+    'a_star': (a_star, {}, 1.0),
+    'ida_star': (ida_star, {}, 1.0),
+    'ucs': (a_star, {'weight': 0}, 1.0),
+    'weighted_a_star': (a_star, {'weight': 2}, 2.0),
+    'anytime': (anytime_a_star, {'budget': 5}, float('inf')),
+    'beam': (beam_search, {'width': 64}, float('inf')),
+}
+
+def portfolio_worker(name: str, X: np.ndarray, results: object):
+    solver, kwargs, guarantee = PORTFOLIO[name]
+    stats = {}
+    begin = time.perf_counter()
+    try:
+        plan = solver(X, stats=stats, **kwargs)
+    except Exception as error: # e.g. MemoryError, or RecursionError in ida_search
+        results.put((name, None, guarantee, {'error': repr(error)}))
+        return
+    stats['seconds'] = time.perf_counter() - begin
+    results.put((name, plan, stats.get('bound', guarantee), stats))
+
+def portfolio(X: np.ndarray, max_bound: float = 1.0, strategies: tuple = None, timeout: float = None, stats: dict = None):
+    '''
+    goal: race several solvers on the same manifest in worker processes and return the first plan whose
+    suboptimality bound is at most max_bound; the other workers are terminated as soon as it arrives
+    plans that miss max_bound are kept, and the best bounded of them is returned if nothing qualifies
+    before every worker finishes (or timeout seconds pass)
+    stats gets 'strategy', 'bound' and the winning solver's own counters
+    '''
+    strategies = strategies if strategies is not None else tuple(PORTFOLIO)
+    deadline = time.perf_counter() + timeout if timeout is not None else None
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=portfolio_worker, args=(name, X, results), daemon=True) for name in strategies]
+    for worker in workers:
+        worker.start()
+
+    best = None
+    pending = dict(zip(strategies, workers)) # workers that have not posted a result yet
+    try:
+        while len(pending) != 0:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            try:
+                name, plan, bound, solver_stats = results.get(timeout=0.5)
+            except queue.Empty:
+                # a worker killed before it could post (e.g. by the OOM killer) will never answer
+                for name, worker in list(pending.items()):
+                    if not worker.is_alive() and results.empty():
+                        del pending[name]
+                continue
+            pending.pop(name, None)
+            if plan is None:
+                continue
+            if best is None or bound < best[2]:
+                best = (name, plan, bound, solver_stats)
+            if bound <= max_bound:
+                break
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+    if best is None:
+        return # path not found
+
+    name, plan, bound, solver_stats = best
+    if stats is not None:
+        stats.update(solver_stats)
+        stats.update(strategy=name, bound=bound)
+    return plan
+
 if __name__ == '__main__':
     FOLDER_PATH = './data/'
     FILE_NAME = 'ShipCase4.txt'
-    X = np.loadtxt(FOLDER_PATH+FILE_NAME, dtype=str, delimiter=',')
-    X[:, 0] = np.char.strip(X[:, 0], "[")
-    X[:, 1] = np.char.strip(X[:, 1], "]")
-    X[:, 2] = np.char.strip(X[:, 2], "{} ")
-    X[:, 3] = np.char.strip(X[:, 3], " ")
+    X, labels = manifest.load(FOLDER_PATH+FILE_NAME)
     actions, total_cost, action_cost = a_star(X)
     print('actions:', actions)
     print('total cost:', total_cost)
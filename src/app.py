@@ -6,16 +6,36 @@ from datetime import datetime
 import os
 # import sys
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, redirect, url_for, abort, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, abort, session, jsonify, send_file, Response
 import secrets
+import io
+import json
+import queue
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import algorithm
-import shutil
+import solution_cache
+import manifest
+import session_store
+import log_writer
+import atexit
+import threading
 
 app = Flask(__name__)
 app.config['data'] = 'data'
 app.secret_key = secrets.token_hex()
 
-# This dictionary will store all of the data for all of the different sessions.
+# Where the sessions and solve jobs are kept: 'memory' for this process only, or 'sqlite' to share them
+# between several worker processes through SESSION_DB. Sessions not used for SESSION_TTL seconds are dropped,
+# and so are the least recently used ones past SESSION_MAX.
+SESSION_BACKEND = 'memory'
+SESSION_DB = './cache/sessions.sqlite3'
+SESSION_MAX = 64
+SESSION_TTL = 12*60*60
+
+# This store will keep all of the data for all of the different sessions.
+# It hands out copies, so a ship that was changed has to be saved with save_ship().
 # The key is the session_id found in the session array managed by Flask.
 # The value is an dictionary containing several things
 # 'grid' = an array of the entire ship at step n. ship[x] = (y_coord, x_coord, container_weight, container_name)
@@ -24,17 +44,55 @@ app.secret_key = secrets.token_hex()
 #           where n is the step we're currently on.
 # 'num_steps' = total number of steps.
 # 'current_step_num' = a counter to track what step we are currently on. Initialized to 0 so that it syncs with the array 'steps'
-# 'move_container' = a boolean that is true if we move a container on this step and false if we're
-#                    just repositioning the claw to the next cell.
+# 'frames' = one row per step: (source row, target row, moves) where the rows are -1 for the park cell and
+#            moves is 1 if a container goes from source to target on this step and 0 if we're
+#            just repositioning the claw to the next cell.
 # 'all_done' = a boolean that is true if we are currently on the last step and false otherwise.
 # 'file_name' = the full path of the file that contains the outbound manifest.
+# 'record_width' = the length in bytes of every line of the outbound manifest, it is patched in place
+#                  until the last step, then the padding is taken off again.
 # 'output_name' = the name that the file should be when we output it.
 # 'total_time' = the total time all of the steps will take not including the steps to and from the park cell.
 # 'costs' = ndarray of costs for each step.
-ships = {}
-PARK_Y_COORD = 9
-PARK_X_COORD = 1
-LOG_FILE_NAME = ''
+# 'job_id' = the id of the background job that solves the uploaded manifest.
+# 'log_file' = the path of the log file of the session.
+ships = session_store.open_store(SESSION_BACKEND, 'ships', SESSION_DB, SESSION_MAX, SESSION_TTL)
+# the crane's park cell, taken from the bay geometry the solver uses
+PARK_Y_COORD, PARK_X_COORD = algorithm.BAY.park
+LOG_FOLDER = './logs/'
+# Every session logs to its own file, written by a background thread (see log_writer).
+# LOG_FLUSH = 'line' to hand every line to the OS right away, 'idle' to do it once nothing else is waiting.
+# LOG_FSYNC = True to also fsync on every such flush; a log is always fsynced before '/close' serves it.
+# At most LOG_QUEUE lines wait to be written, past that log() waits for the writer to catch up.
+LOG_FLUSH = 'idle'
+LOG_FSYNC = False
+LOG_QUEUE = 1024
+logs = log_writer.LogWriter(LOG_QUEUE, SESSION_MAX, LOG_FLUSH, LOG_FSYNC)
+atexit.register(logs.stop)
+# how many seconds the solver may spend improving a plan before the grid page is shown.
+# None runs the exact search to completion.
+SOLVE_BUDGET = 10
+# when moves are flushed to the outbound manifest on disk:
+# 'step' after every container move, 'cycle' once when the last step is done or the manifest is downloaded
+MANIFEST_DURABILITY = 'step'
+
+# Uploads are solved in the background so a hard manifest doesn't hold up the other sessions.
+# The key is the job id handed to the browser, the value is a dictionary containing
+# 'status' = 'queued', 'running', 'done' or 'failed'
+# 'error' = what went wrong if the job failed, '' otherwise
+# 'progress' = the latest progress report of the search (see algorithm.Progress), None until there is one
+jobs = session_store.open_store(SESSION_BACKEND, 'jobs', SESSION_DB, SESSION_MAX, SESSION_TTL)
+SOLVE_WORKERS = 2
+# the job threads fill in the ship dictionaries, the searches themselves run in separate
+# processes so they don't hold the interpreter lock while other requests are served
+job_pool = ThreadPoolExecutor(max_workers=SOLVE_WORKERS)
+search_pool = ProcessPoolExecutor(max_workers=SOLVE_WORKERS)
+# how many seconds apart the search sends progress reports
+PROGRESS_INTERVAL = 0.5
+# the manager process that carries progress reports out of the search pool, started on the first solve
+progress_manager = None
+# held while search_pool or progress_manager is replaced, the job threads may do it at the same time
+search_lock = threading.Lock()
 
 def log_header():
     time = datetime.now()
@@ -45,30 +103,98 @@ def log_header():
         return output
     return extend(time.month) + " " + extend(time.day) + " " + str(time.year) + ": " + extend(time.hour) + ":" + extend(time.minute) + " "
 
-def log(str):
-    with open(LOG_FILE_NAME, "a") as file:
-        file.write(log_header() + str + "\n")
+# input: the message, and the log file to write it to (the current session's by default)
+def log(str, log_file=None):
+    if log_file is None:
+        log_file = session_log()
+    logs.write(log_file, log_header() + str + "\n")
 
 # input: none
-# output: a reference to the dictionary holding all of the info for the current session.
-#         This way we don't have to type ships[session['session_id']] all the time.
-def get_ship():
-    return ships[session['session_id']]
+# output: the path of a new log file, named after the time it was started
+# If another session already started a log this minute, the new one gets a number after the name.
+def start_log():
+    time = datetime.now()
+    def extend(int):
+        output = str(int)
+        if int < 10:
+            output = '0' + output
+        return output
+    file_name = "KeoghsPort" + extend(time.month) + "_" + extend(time.day) + "_" + str(time.year) + "_" + extend(time.hour) + extend(time.minute) + ".txt"
 
-# input: ints y and x that are the y and x coords of a cell
-# output: the index in the grid of the row that contain the info on the specified cell
-def grid_index(y, x):
-    y_coord = str(y)
-    if y < 10:
-        y_coord = '0' + y_coord
+    # create it right away so two sessions can't pick the same name
+    while True:
+        file_name = get_unique_file_name(LOG_FOLDER, file_name)
+        try:
+            open(LOG_FOLDER + file_name, "x").close()
+            break
+        except FileExistsError:
+            continue
+    logs.write(LOG_FOLDER + file_name, log_header() + "Window was opened.\n")
+    return LOG_FOLDER + file_name
 
-    x_coord = str(x)
-    if x < 10:
-        x_coord = '0' + x_coord
+# input: none
+# output: the path of the current session's log file, started if it doesn't have one yet
+def session_log():
+    if 'log_file' not in session:
+        session['log_file'] = start_log()
+    return session['log_file']
 
-    X = get_ship()['grid']
-    index = np.where((X[:, 0] == y_coord) & (X[:, 1] == x_coord))[0]
-    return index[0]
+# input: none
+# output: a copy of the dictionary holding all of the info for the current session.
+#         This way we don't have to type ships[session['session_id']] all the time.
+#         A session that was evicted (or never started) gets a 404.
+def get_ship():
+    ship = ships.get(session.get('session_id'))
+    if ship is None:
+        abort(404)
+    return ship
+
+# input: the ship of the current session after changing it
+def save_ship(ship):
+    ships[session['session_id']] = ship
+
+# Since the store hands out copies, two overlapping requests of one session that change its ship would
+# both start from the same copy and the later save would undo the earlier one. Such requests hold the
+# lock of their session from get_ship() to save_ship(). Sessions share SESSION_LOCKS locks by hash so
+# there is no lock to clean up per session. The locks only cover this process, so with the 'sqlite'
+# backend and several worker processes a session's requests still have to go to one of them.
+SESSION_LOCKS = 64
+session_locks = [threading.Lock() for _ in range(SESSION_LOCKS)]
+
+# output: the lock of the current session
+def ship_lock():
+    return session_locks[hash(session.get('session_id')) % SESSION_LOCKS]
+
+# input: a job id and the entries of the job to change
+def update_job(job_id, **changes):
+    job = jobs[job_id]
+    job.update(changes)
+    jobs[job_id] = job
+
+# input: the grid and the steps of a plan
+# output: the frames described at the top, so stepping never has to search the grid
+def step_frames(grid, steps):
+    # cell_index[y, x] is the row of the grid that holds cell (y, x), -1 for the park cell
+    ys, xs = grid[:, 0].astype(int), grid[:, 1].astype(int)
+    cell_index = np.full((max(ys.max(), PARK_Y_COORD) + 1, max(xs.max(), PARK_X_COORD) + 1), -1, dtype=np.int16)
+    cell_index[ys, xs] = np.arange(len(grid))
+    cell_index[PARK_Y_COORD, PARK_X_COORD] = -1
+
+    frames = np.zeros((len(steps), 3), dtype=np.int16)
+    if len(steps) != 0:
+        steps = steps.astype(int)
+        frames[:, 0] = cell_index[steps[:, 0], steps[:, 1]]
+        frames[:, 1] = cell_index[steps[:, 2], steps[:, 3]]
+        # the claw moves to a container, then moves it, and so on
+        frames[1::2, 2] = (frames[1::2, 0] >= 0) & (frames[1::2, 1] >= 0)
+    return frames
+
+# input: a ship, a row of its grid (-1 for the park cell) and the color to give it
+def highlight(ship, row, color):
+    if row < 0:
+        ship['park'] = color
+    else:
+        ship['grid'][row, 4] = color
 
 def get_unique_file_name(folder_path, file_name):
     counter = 0
@@ -79,43 +205,112 @@ def get_unique_file_name(folder_path, file_name):
         file_name = original + str(counter) + extension
     return file_name
 
-# formats the data, runs the algorithm, and fills the dictionary
-def call_algorithm(filename):
+def progress_queue():
+    global progress_manager
+    with search_lock:
+        if progress_manager is None:
+            progress_manager = multiprocessing.Manager()
+        return progress_manager.Queue()
+
+# a search process that dies (e.g. killed for running out of memory) breaks its whole pool,
+# so broken is swapped for a new pool unless another job already did that
+def restart_search_pool(broken):
+    global search_pool
+    with search_lock:
+        if search_pool is broken:
+            search_pool = ProcessPoolExecutor(max_workers=SOLVE_WORKERS)
+    broken.shutdown(wait=False)
+
+# output: the pool the search was submitted to and its future
+def submit_search(X, budget, reports):
+    pool = search_pool
+    try:
+        return pool, pool.submit(search, X, budget, reports)
+    except BrokenProcessPool:
+        # broken by another job's search, this one hasn't run yet so it gets a new pool
+        restart_search_pool(pool)
+        pool = search_pool
+        return pool, pool.submit(search, X, budget, reports)
+
+# runs in the search pool: solves X (an 8x12 bay, see call_algorithm) and puts the progress reports into reports
+# output: (plan, bound) where bound is how many times the cheapest plan the plan may cost, 1.0 if it is proven optimal
+def search(X, budget, reports):
+    if budget is None:
+        return algorithm.a_star(X, progress=reports.put, interval=PROGRESS_INTERVAL, bay=algorithm.BAY), 1.0
+    stats = {}
+    plan = algorithm.anytime_a_star(X, budget, stats=stats, progress=reports.put, interval=PROGRESS_INTERVAL,
+                                    bay=algorithm.BAY)
+    return plan, stats.get('bound', float('inf'))
+
+# formats the data, runs the algorithm, and fills the ship dictionary
+# budget is the number of seconds the anytime solver may spend improving the plan (None = exact a_star)
+# on_progress is called with every progress report of the search
+def call_algorithm(filename, ship, budget=SOLVE_BUDGET, on_progress=None):
     FOLDER_PATH = './data/'
-    X = np.loadtxt(FOLDER_PATH+filename, dtype=str, delimiter=',')
-
-    # remove unnecessary characters
-    X[:, 0] = np.char.strip(X[:, 0], "[")
-    X[:, 1] = np.char.strip(X[:, 1], "]")
-    X[:, 2] = np.char.strip(X[:, 2], "{} ")
-    X[:, 3] = np.char.strip(X[:, 3], " ")
+    # the solver takes the typed cells, the grid page shows them as strings
+    cells, labels = manifest.load(FOLDER_PATH+filename)
+    # the grid page and the crane's park cell are laid out for the 8x12 bay only
+    bay = algorithm.Bay.from_manifest(algorithm.manifest_arrays(cells)[0])
+    if bay is not algorithm.BAY:
+        raise ValueError("manifest describes a " + str(bay.rows) + "x" + str(bay.cols) + " bay, only "
+                         + str(algorithm.BAY.rows) + "x" + str(algorithm.BAY.cols) + " bays can be balanced here")
+    X = manifest.to_strings(cells, labels)
     X = np.hstack((X, np.array([[""] * len(X)]).T))
-    ship = get_ship()
     ship['grid'] = X
 
     # log the file opening
-    num_containers = len(np.where((X[:, 3] != 'NAN') & (X[:, 3] != 'UNUSED'))[0])
+    num_containers = np.count_nonzero(cells['label'] > manifest.UNUSED)
     ending = ''
     if num_containers != 1:
         ending = " containers on the ship."
     else:
         ending = " container on the ship."
-    log("Manifest " + filename + " is opened, there are " + str(num_containers) + ending)
-
-    steps, total_time, costs = algorithm.a_star(X)
+    log("Manifest " + filename + " is opened, there are " + str(num_containers) + ending, ship['log_file'])
+
+    # a manifest with the same weight layout may have been solved before
+    solver = 'a_star' if budget is None else 'anytime'
+    key = solution_cache.fingerprint(cells, solver)
+    cached = solution_cache.get(key)
+    if cached is not None:
+        steps, total_time, costs = cached
+    else:
+        reports = progress_queue()
+        pool, solve = submit_search(cells, budget, reports)
+        # pass the reports on until the search is over and every report has been read
+        while not (solve.done() and reports.empty()):
+            try:
+                report = reports.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if on_progress is not None:
+                on_progress(report)
+        try:
+            (steps, total_time, costs), bound = solve.result()
+        except BrokenProcessPool:
+            # only the jobs searching in the broken pool fail, the next ones get a new pool
+            restart_search_pool(pool)
+            raise RuntimeError("the search process stopped before it found a plan, the manifest may be too big to solve")
+        # a plan the budget cut short may be beaten by solving again, so only optimal ones are kept
+        if bound <= 1.0:
+            solution_cache.put(key, steps, total_time, costs)
 
     # make a new file called "file_nameOUTBOUND.txt"
     output_name = filename.split(".")[0]+"OUTBOUND.txt"
     full_name = FOLDER_PATH + get_unique_file_name(FOLDER_PATH, output_name)
     
-    shutil.copyfile(FOLDER_PATH + filename, full_name)
-
     ship['file_name'] = full_name
     ship['output_name'] = output_name
 
     # if there are no steps to take, that means the ship is already balanced
     already_balanced = len(steps) == 0
 
+    # a manifest that is going to be patched gets fixed width records, one that isn't is done already
+    if not already_balanced:
+        ship['record_width'] = manifest.write_records(full_name, cells, labels)
+    else:
+        manifest.write_lines(full_name, cells, labels)
+        ship['record_width'] = None
+
     # if the ship is already balanced, don't add the movements for going
     # to and from the park cell
     # if not already_balanced:
@@ -133,7 +328,7 @@ def call_algorithm(filename):
         minutes = " minutes"
     else:
         minutes = " minute"
-    log("Balance solution found, it will require " + str(len(steps)) + moves + "/" + str(total_time) + minutes + ".")
+    log("Balance solution found, it will require " + str(len(steps)) + moves + "/" + str(total_time) + minutes + ".", ship['log_file'])
 
     # if the ships is already balanced, we don't have to display any steps
     if not already_balanced:
@@ -145,53 +340,48 @@ def call_algorithm(filename):
     ship['num_steps'] = len(steps)
     ship['current_step_num'] = 0
     ship['total_time'] = total_time
-    ship['move_container'] = False
     ship['all_done'] = already_balanced
     ship['costs'] = costs
+    ship['frames'] = step_frames(ship['grid'], steps)
 
     if not already_balanced:
-        index = grid_index(steps[0, 2], steps[0, 3])
-        ship['grid'][index, 4] = 'red'
+        highlight(ship, ship['frames'][0, 1], 'red')
+
+# runs in the job pool: solves the manifest for the ship of session_id and keeps jobs[job_id] up to date
+# log_file is the log of that session, there is no request (and so no session) in the job threads
+def run_job(job_id, filename, session_id, log_file):
+    update_job(job_id, status='running')
+    try:
+        ship = ships[session_id]
+        call_algorithm(filename, ship, on_progress=lambda report: update_job(job_id, progress=report))
+        ships[session_id] = ship
+    except Exception as error:
+        update_job(job_id, status='failed', error=str(error))
+        log("Manifest " + filename + " could not be balanced: " + str(error), log_file)
+        return
+    update_job(job_id, status='done')
 
 def unique_token():
     while True:
         # Use the number 16 since it's what most encryption services use
         # so it must be pretty good.
         token = secrets.token_urlsafe(16)
-        if token not in ships:
+        if token not in ships and token not in jobs:
             return token
 
 # GET method that just redirects you to to start.html
 # If it is the first time the window was opened, start a log file.
 @app.route("/")
 def display_start():
-    global LOG_FILE_NAME
-    # if we haven't given it a 'first_log' entry yet
+    # if we haven't given it a 'log_file' entry yet
     # this means it's the first time on the page for this session
-    if 'first_log' not in session:
-        time = datetime.now()
-        def extend(int):
-            output = str(int)
-            if int < 10:
-                output = '0' + output
-            return output
-        file_name = "KeoghsPort" + extend(time.month) + "_" + extend(time.day) + "_" + str(time.year) + "_" + extend(time.hour) + extend(time.minute) + ".txt"
-        path = './logs/'
-        LOG_FILE_NAME = path + file_name
-
-        # if a file already exists with that name, delete the old file
-        if os.path.exists(LOG_FILE_NAME):
-            os.remove(LOG_FILE_NAME)
-
-        with open(LOG_FILE_NAME, "a") as file:
-            file.write(log_header() + "Window was opened.\n")
-        session['first_log'] = False
+    session_log()
     return render_template("start.html")
 
 # POST request that takes in a file in the body of the request.
 # The file should have the key 'file'.
-# Saves the file into the 'data' folder.
-# Redirects to the grid page if the file exists.
+# Saves the file into the 'data' folder and queues a job to solve it.
+# Redirects to the grid page right away if the file exists, the page waits for the job to finish.
 @app.route('/', methods = ['POST'])
 def upload():
     # get the file with the 'file' key from the request
@@ -217,10 +407,12 @@ def upload():
         # To fix this, we use our own dictionary to store info.
         # V stores a session_id in the browser cookies
         session['session_id'] = unique_token()
-        ships[session['session_id']] = {}
 
-        # call the algorithm portion to do its thing on the info in the file
-        call_algorithm(filename)
+        # queue the algorithm portion to do its thing on the info in the file
+        job_id = unique_token()
+        jobs[job_id] = {'status': 'queued', 'error': '', 'progress': None}
+        ships[session['session_id']] = {'job_id': job_id, 'log_file': session_log()}
+        job_pool.submit(run_job, job_id, filename, session['session_id'], session_log())
 
         # redirect to the grid display page
         return redirect(url_for('display_grid'))
@@ -229,12 +421,65 @@ def upload():
     return redirect(url_for('display_start'))
 
 # GET method that just redirects you to to grid.html
+# The page gets the id of the job solving its manifest so it can wait for the plan.
 @app.route("/grid")
 def display_grid():
-    return render_template("grid.html")
+    return render_template("grid.html", job_id=get_ship().get('job_id', ''))
+
+# GET method that returns a json with the status of a solve job.
+# status is 'queued', 'running', 'done' or 'failed', error says what went wrong if it failed.
+@app.route('/api/job/<job_id>', methods = ['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(status=job['status'], error=job['error'])
+
+# GET method that streams the progress of a solve job as server-sent events.
+# Every new progress report is sent as a json message with 'status' and 'progress',
+# and an 'end' event is sent once the job is done or failed.
+@app.route('/api/job/<job_id>/progress', methods = ['GET'])
+def job_progress(job_id):
+    if job_id not in jobs:
+        abort(404)
+
+    def stream():
+        last = None
+        while True:
+            job = jobs.get(job_id)
+            if job is None:
+                return
+            if job['progress'] != last:
+                last = job['progress']
+                yield "data: " + json.dumps({'status': job['status'], 'progress': last}) + "\n\n"
+            if job['status'] in ('done', 'failed'):
+                yield "event: end\ndata: " + json.dumps({'status': job['status']}) + "\n\n"
+                return
+            time.sleep(PROGRESS_INTERVAL/2)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# input: a ship
+# output: a number that goes up by one with every step, the last step counts twice since it only sets 'all_done'
+def grid_version(ship):
+    return int(ship['current_step_num']) + int(ship['all_done'])
+
+# input: a ship and the rows of its grid that changed (-1 for the park cell)
+# output: a json holding just what changed: the new version, the changed rows as [row, y, x, weight, name, color],
+#         the park color, the step counter and 'all_done'
+def grid_delta(ship, rows):
+    rows = sorted(set(int(row) for row in rows if row >= 0))
+    return jsonify(version=grid_version(ship),
+                   cells=[[row] + ship['grid'][row].tolist() for row in rows],
+                   park_cell=ship['park'],
+                   current_step_num=ship['current_step_num'],
+                   all_done=ship['all_done'])
 
 # GET method that returns a json containing all the info needed to display the grid.
 # This will be the information for the current step, not the next step.
+# The page loads this once and then patches it with the deltas of '/api/next_grid'. It also gets
+# 'frames' so it can draw the next step before the server answers, and 'version' to check the answers against.
+# The response has an ETag, so asking again with If-None-Match gets an empty 304 if nothing changed.
 # Any method that starts with '/api' returns a json
 @app.route('/api/current_grid', methods = ['GET'])
 def current_grid():
@@ -242,64 +487,85 @@ def current_grid():
     temp_steps = []
     if len(ship['steps']) != 0:
         temp_steps = ship['steps'].tolist()
-    return jsonify(grid=ship['grid'].tolist(),
-                   park_cell=ship['park'],
-                   steps=temp_steps,
-                   num_steps=ship['num_steps'],
-                   current_step_num=ship['current_step_num'],
-                   all_done=ship['all_done'],
-                   total_time=int(ship['total_time']),
-                   costs=ship['costs'].tolist(),
-                   file_name=ship['output_name'])
-                   
+    response = jsonify(grid=ship['grid'].tolist(),
+                       park_cell=ship['park'],
+                       steps=temp_steps,
+                       num_steps=ship['num_steps'],
+                       current_step_num=ship['current_step_num'],
+                       all_done=ship['all_done'],
+                       total_time=int(ship['total_time']),
+                       costs=ship['costs'].tolist(),
+                       file_name=ship['output_name'],
+                       frames=ship['frames'].tolist(),
+                       version=grid_version(ship))
+    response.set_etag(ship.get('job_id', '') + "-" + str(grid_version(ship)))
+    # the browser has to check back every time, but only gets the grid again if it changed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# input: a ship that is not all done
+# output: the rows of its grid that changed (-1 for the park cell) after moving it on by one step
+def advance(ship):
+    # clear the colors of this step
+    curr_step = ship['current_step_num']
+    source, target, moves = ship['frames'][curr_step]
+    highlight(ship, source, '')
+    highlight(ship, target, '')
+
+    # if we just finished the last step, we'll clear the colors and flip to 'all_done'
+    # bool to indicate that we're done. We will not change anything else.
+    if curr_step >= ship['num_steps'] - 1:
+        ship['all_done'] = True
+        return [source, target]
 
-# POST method to call when the user presses the enter key. returns the next grid step.
+    # if we moved a container this step, swap the data but not the coordinates
+    if moves:
+        ship['grid'][[source, target], 2:4] = ship['grid'][[target, source], 2:4]
+
+    # update 'current_step_num'
+    ship['current_step_num'] += 1
+
+    # color the source cell 'green' and the target cell 'red'
+    new_source, new_target, _ = ship['frames'][ship['current_step_num']]
+    highlight(ship, new_source, 'green')
+    highlight(ship, new_target, 'red')
+    return [source, target, new_source, new_target]
+
+# POST method to call when the user presses the enter key. Moves on to the next step.
 # Input: none
-# Output: all the info you need to display the graph
-#   - grid
+# Output: the delta from the step before (see grid_delta)
+#   - version
+#   - cells
 #   - park_cell
-#   - steps
-#   - num_steps
 #   - current_step_num
-#   - is_last_step
+#   - all_done
 # If you call this method and we're already on the last step, it will not advance the info
-# and will just return the grid data as if you were just calling the '/api/current_grid' method
+# and will just return the current version with no changed cells
 @app.route('/api/next_grid', methods = ['POST'])
 def next_grid():
+    with ship_lock():
+        return take_step()
+
+# moves the ship of the current session on by one step, logs it and patches the manifest
+# output: the response of '/api/next_grid'
+def take_step():
     ship = get_ship()
     
     # if we're already on the last step, just return the json and do nothing else
     if ship['all_done']:
-        return current_grid()
-
-    # clear the color of the first cell
-    curr_step = ship['current_step_num']
-    first_y_coord = ship['steps'][curr_step, 0]
-    first_x_coord = ship['steps'][curr_step, 1]
-    if first_y_coord == PARK_Y_COORD and first_x_coord == PARK_X_COORD:
-        ship['park'] = ''
-    else:
-        ship['grid'][grid_index(first_y_coord, first_x_coord), 4] = ''
-
-    # clear the color of the second cell
-    second_y_coord = ship['steps'][curr_step, 2]
-    second_x_coord = ship['steps'][curr_step, 3]
-    if second_y_coord == PARK_Y_COORD and second_x_coord == PARK_X_COORD:
-        ship['park'] = ''
-    else:
-        ship['grid'][grid_index(second_y_coord, second_x_coord), 4] = ''
+        return grid_delta(ship, [])
 
     def to_string(num):
         output = str(num)
         if num < 10:
             output = '0' + output
         return output
-    coords = ship['steps'][curr_step]
+    coords = ship['steps'][ship['current_step_num']]
     first = "[" + to_string(coords[0]) + "," + to_string(coords[1]) + "]"
-    if coords[0] == 9:
+    if coords[0] == PARK_Y_COORD and coords[1] == PARK_X_COORD:
         first = "PARK"
     second = "[" + to_string(coords[2]) + "," + to_string(coords[3]) + "]"
-    if coords[2] == 9:
+    if coords[2] == PARK_Y_COORD and coords[3] == PARK_X_COORD:
         second = "PARK"
     real_minutes = ship['costs'][ship['current_step_num']]
     minutes = "minutes"
@@ -307,85 +573,45 @@ def next_grid():
         minutes = "minute"
     log(str(ship['current_step_num'] + 1) + " of " + str(ship['num_steps']) + ": Move from " + first + " to " + second + ", " + str(real_minutes) + " " + minutes)
 
-    # if we just finished the last step, we'll clear the colors and flip to 'all_done'
-    # bool to indicate that we're done. We will not change anything else.
-    if ship['current_step_num'] >= ship['num_steps'] - 1:
-        ship['all_done'] = True
-        return current_grid()
-
-    # if we moved a container this step, update 'grid' and the manifest
-    if ship['move_container']:
-        first_index = grid_index(first_y_coord, first_x_coord)
-        second_index = grid_index(second_y_coord, second_x_coord)
-
-        # update the manifest
-        # get a list of the lines in the file
-        file = []
-        with open(ship['file_name'], "r") as r:
-            file = r.readlines()
-    
-        # rewrite the specific lines
-        def to_formatted_string(line):
-            return "[" + line[0] + "," + line[1] + "], {" + line[2] + "}, " + line[3] + "\n"
-        
-        # create a copy of the lines to be swapped
-        line1 = ship['grid'][first_index].copy()
-        line2 = ship['grid'][second_index].copy()
-
-        # swap the data but not the coordinates
-        line1[2], line2[2] = line2[2], line1[2]
-        line1[3], line2[3] = line2[3], line1[3]
-
-        # write the new lines to the list 'file'
-        file[first_index] = to_formatted_string(line1)
-        file[second_index] = to_formatted_string(line2)
-
-        # write it to the file
-        with open(ship['file_name'], "w") as w:
-            w.writelines(file)
-
-        # update the 'grid' in the same way
-        ship['grid'][first_index, 2], ship['grid'][second_index, 2] = ship['grid'][second_index, 2], ship['grid'][first_index, 2]
-        ship['grid'][first_index, 3], ship['grid'][second_index, 3] = ship['grid'][second_index, 3], ship['grid'][first_index, 3]
-
-    # update 'current_step_num'
-    ship['current_step_num'] += 1
-
-    # update 'move_container'
-    ship['move_container'] = not ship['move_container']
-
-    # color the source cell 'green'
-    new_step_num = ship['current_step_num']
-    new_first_y_coord = ship['steps'][new_step_num, 0]
-    new_first_x_coord = ship['steps'][new_step_num, 1]
-    if new_first_y_coord == PARK_Y_COORD and new_first_x_coord == PARK_X_COORD:
-        ship['park'] = 'green'
-    else:
-         ship['grid'][grid_index(new_first_y_coord, new_first_x_coord), 4] = 'green'
+    source, target, moves = ship['frames'][ship['current_step_num']]
+    changed = advance(ship)
 
-    # color the target cell 'red'
-    new_second_y_coord = ship['steps'][new_step_num, 2]
-    new_second_x_coord = ship['steps'][new_step_num, 3]
-    if new_second_y_coord == PARK_Y_COORD and new_second_x_coord == PARK_X_COORD:
-        ship['park'] = 'red'
-    else:
-         ship['grid'][grid_index(new_second_y_coord, new_second_x_coord), 4] = 'red'
+    if ship['all_done']:
+        # the cycle is over, so the manifest doesn't need the padding for patching anymore
+        manifest.unpad_records(ship['file_name'])
+    elif moves:
+        # overwrite just the two lines of the manifest that the container moved between
+        manifest.patch_records(ship['file_name'], ship['record_width'],
+                               {int(source): tuple(ship['grid'][source, 0:4]), int(target): tuple(ship['grid'][target, 0:4])},
+                               durable=MANIFEST_DURABILITY == 'step')
 
-    return current_grid()
+    save_ship(ship)
+    return grid_delta(ship, changed)
 
 # input: none
 # output: the new manifest will be downloaded into the user's downloads folder
 @app.route('/download_manifest')
 def download_manifest():
+    # the last step may be turning the manifest into plain lines right now
+    with ship_lock():
+        return send_manifest()
+
+# output: the response of '/download_manifest'
+def send_manifest():
     ship = get_ship()
 
     # log the output
     log("Finished a Cycle. Manifest " + ship['output_name'] + " was written to desktop, and a reminder pop-up to operator to send file was displayed.")
     
-    # output the file
+    # output the file as a plain manifest, without the padding that lets us patch it in place
     current_directory = os.path.dirname(os.path.abspath(__file__))
     path = os.path.join(current_directory, '..', 'data', ship['file_name'].split("/")[-1])
     full_path = os.path.normpath(path)
+    if not ship['all_done']:
+        # still being stepped through, so leave the file padded and send a plain copy
+        manifest.sync(ship['file_name'])
+        return send_file(io.BytesIO(manifest.unpadded(full_path)), as_attachment = True, download_name = ship['output_name'])
+    manifest.unpad_records(full_path)
     return send_file(full_path, as_attachment = True, download_name = ship['output_name'])
 
 # input: what the user wants to log
@@ -403,8 +629,11 @@ def close():
     log("Log file was downloaded.")
 
     ship = get_ship()
+    # everything logged so far has to be in the file before it is sent
+    log_file = session_log()
+    logs.flush(log_file)
     current_directory = os.path.dirname(os.path.abspath(__file__))
-    plain_name = LOG_FILE_NAME.split("/")[-1]
+    plain_name = log_file.split("/")[-1]
     path = os.path.join(current_directory, '..', 'logs', plain_name)
     full_path = os.path.normpath(path)
     return send_file(full_path, as_attachment = True, download_name = plain_name)
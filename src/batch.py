@@ -0,0 +1,206 @@
+import numpy as np
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+import algorithm
+import manifest
+import solution_cache
+
+# Solving many manifests at once, e.g. to plan the next day's ships overnight.
+# Every manifest is solved in its own process, at most --workers at a time, and one that takes longer than
+# --timeout seconds is stopped. Each result is printed as soon as it is ready as one json line:
+#   {"manifest", "outbound", "steps", "total_minutes", "costs", "seconds", "expanded", "bound", "cached"}
+# or {"manifest", "failed"} if there was no plan. The ship as it is after the plan is written to an OUTBOUND
+# manifest next to the input (or into --outbound-dir), named the way the web app names them, and read back to
+# check it. 'bound' is how many times the cheapest plan the plan may cost, 1.0 if it is proven optimal.
+# With --cache an optimal plan is also stored in the solution cache, so the app shows it right away when
+# the same ship is uploaded.
+#
+# run from the project folder:
+#   python ./src/batch.py ./data                                  (every manifest in data/)
+#   python ./src/batch.py './advanced_data/RowCase*.txt' --output plans.jsonl --workers 4 --timeout 300
+#   python ./src/batch.py ./incoming --cache --no-outbound
+#   python ./src/batch.py ./incoming --manifest-cache ./cache/manifests   (parse every manifest only once)
+
+SOLVERS = {
+    'a_star': algorithm.a_star,
+    'anytime': algorithm.anytime_a_star,
+    'ida_star': algorithm.ida_star,
+    'beam': algorithm.beam_search,
+}
+# same as the web app, so plans stored with --cache are found by it
+SOLVE_BUDGET = 10
+# the stems of the OUTBOUND manifests we write, also the numbered ones picked when the name was taken
+OUTBOUND = re.compile(r"OUTBOUND\d*$")
+
+# input: directories and glob patterns
+# output: the sorted paths of the manifests they name, without the OUTBOUND manifests written earlier
+def manifest_paths(inputs):
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.txt")
+        paths.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(path for path in paths if OUTBOUND.search(os.path.basename(path).split(".")[0]) is None)
+
+# input: a folder and the file name we'd like to use
+# output: the path of a file that does not exist yet, with a number after the name if it has to (like the web app)
+def unique_path(folder, file_name):
+    counter = 0
+    original = file_name.split(".")[0]
+    extension = "." + file_name.split(".")[1]
+    while os.path.exists(os.path.join(folder, file_name)):
+        counter += 1
+        file_name = original + str(counter) + extension
+    return os.path.join(folder, file_name)
+
+# runs in its own process so it can be stopped when it takes too long
+def solve(path, solver, budget, results, manifest_cache=None):
+    kwargs = {'budget': budget} if solver == 'anytime' else {}
+    stats = {}
+    try:
+        cells, _ = manifest.load(path, manifest_cache)
+        begin = time.perf_counter()
+        plan = SOLVERS[solver](cells, stats=stats, **kwargs)
+        seconds = time.perf_counter() - begin
+    except Exception as error:
+        results.put((path, {'failed': str(error)}))
+        return
+    if plan is None:
+        results.put((path, {'failed': 'no plan found'}))
+        return
+    steps, total_time, costs = plan
+    results.put((path, {
+        'steps': np.asarray(steps).astype(int).tolist(),
+        'total_minutes': int(total_time),
+        'costs': np.asarray(costs).astype(int).tolist(),
+        'seconds': seconds,
+        'expanded': stats.get('expanded', 0),
+        # the solvers that don't report a bound have the guarantee they have in the portfolio
+        'bound': stats.get('bound', algorithm.PORTFOLIO[solver][2]),
+        'cached': False,
+    }))
+
+# input: the path of a solved manifest and its result, where to put the OUTBOUND manifest (None = next to it),
+#        whether to store the plan in the solution cache and the folder of parsed manifests (see manifest.load)
+# output: the result with 'outbound' filled in
+# Nobody steps through a batch plan, so the OUTBOUND manifest gets the layout the ship has after the whole plan.
+def finish(path, result, solver, outbound_dir, cache, manifest_cache=None):
+    result = dict(result)
+    if 'failed' in result:
+        return result
+    cells, labels = manifest.load(path, manifest_cache)
+    # a plan the budget or the beam cut short may be beaten by solving again, so only optimal ones are kept
+    if cache and not result['cached'] and result['bound'] <= 1.0:
+        solution_cache.put(solution_cache.fingerprint(cells, solver), result['steps'], result['total_minutes'], result['costs'])
+    result['outbound'] = None
+    if outbound_dir is not False:
+        folder = os.path.dirname(path) if outbound_dir is None else outbound_dir
+        os.makedirs(folder, exist_ok=True)
+        result['outbound'] = unique_path(folder, os.path.basename(path).split(".")[0] + "OUTBOUND.txt")
+        balanced = algorithm.rebuild_manifest(cells, np.array(result['steps'], dtype=int))
+        manifest.write_lines(result['outbound'], balanced, labels)
+        if not holds(result['outbound'], balanced, labels):
+            return {'failed': result['outbound'] + " does not hold the layout of the plan"}
+    return result
+
+# input: the path of a written OUTBOUND manifest, and the cells and labels it should hold
+# output: True if reading the file back gives exactly those cells and labels
+def holds(path, cells, labels):
+    written, written_labels = manifest.load(path)
+    return manifest.format_lines(written, written_labels) == manifest.format_lines(cells, labels)
+
+# input: manifest paths and how to solve them, and a function that gets every (path, result) as soon as it's done
+# Solves the manifests in up to workers processes at a time, giving each one timeout seconds (None = no limit).
+# With a manifest_cache folder every manifest is parsed once and memory mapped from there afterwards,
+# also by later runs over the same unchanged files.
+def solve_all(paths, report, solver='anytime', budget=SOLVE_BUDGET, workers=None, timeout=None,
+              outbound_dir=None, cache=False, manifest_cache=None):
+    workers = workers or os.cpu_count() or 1
+    results = multiprocessing.Queue()
+    waiting = list(reversed(paths))
+    running = {} # path -> (process, deadline)
+    while len(waiting) != 0 or len(running) != 0:
+        while len(waiting) != 0 and len(running) < workers:
+            path = waiting.pop()
+            if cache:
+                try:
+                    cached = solution_cache.get(solution_cache.fingerprint(manifest.load(path, manifest_cache)[0], solver))
+                except ValueError as error:
+                    report(path, {'failed': str(error)})
+                    continue
+                if cached is not None:
+                    steps, total_time, costs = cached
+                    report(path, finish(path, {'steps': steps.tolist(), 'total_minutes': int(total_time),
+                                               'costs': costs.tolist(), 'seconds': 0.0, 'expanded': 0, 'bound': 1.0,
+                                               'cached': True},
+                                        solver, outbound_dir, cache, manifest_cache))
+                    continue
+            process = multiprocessing.Process(target=solve, args=(path, solver, budget, results, manifest_cache), daemon=True)
+            process.start()
+            running[path] = (process, time.perf_counter() + timeout if timeout is not None else None)
+
+        try:
+            path, result = results.get(timeout=0.1)
+        except queue.Empty:
+            # look for manifests that took too long or whose process died (e.g. ran out of memory)
+            now = time.perf_counter()
+            for path, (process, deadline) in list(running.items()):
+                if deadline is not None and now > deadline:
+                    process.terminate()
+                    result = {'failed': 'timed out after ' + str(timeout) + " s"}
+                elif not process.is_alive() and results.empty():
+                    result = {'failed': 'exit code ' + str(process.exitcode)}
+                else:
+                    continue
+                process.join()
+                del running[path]
+                report(path, result)
+            continue
+        running.pop(path)[0].join()
+        report(path, finish(path, result, solver, outbound_dir, cache, manifest_cache))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve every manifest in the given folders or glob patterns.")
+    parser.add_argument('inputs', nargs='+', help="folders (every .txt file in them) or glob patterns")
+    parser.add_argument('--solver', default='anytime', choices=sorted(SOLVERS))
+    parser.add_argument('--budget', default=SOLVE_BUDGET, type=float, help="seconds the anytime solver may spend improving a plan")
+    parser.add_argument('--workers', default=None, type=int, help="manifests solved at once, the number of CPUs by default")
+    parser.add_argument('--timeout', default=None, type=float, help="seconds per manifest")
+    parser.add_argument('--output', default='-', help="json lines file to write the results to, - for the terminal")
+    parser.add_argument('--outbound-dir', default=None, help="folder for the OUTBOUND manifests, next to each manifest by default")
+    parser.add_argument('--no-outbound', action='store_true', help="don't write OUTBOUND manifests")
+    parser.add_argument('--cache', action='store_true', help="reuse and store plans in the solution cache of the web app")
+    parser.add_argument('--manifest-cache', default=None, help="folder to keep parsed manifests in, later runs memory map them")
+    args = parser.parse_args(argv)
+
+    paths = manifest_paths(args.inputs)
+    if len(paths) == 0:
+        print("no manifests found", file=sys.stderr)
+        return 1
+
+    failed = []
+    output = sys.stdout if args.output == '-' else open(args.output, "w")
+    def report(path, result):
+        if 'failed' in result:
+            failed.append(path)
+        output.write(json.dumps({'manifest': path, **result}) + "\n")
+        output.flush()
+    try:
+        solve_all(paths, report, args.solver, args.budget, args.workers, args.timeout,
+                  False if args.no_outbound else args.outbound_dir, args.cache, args.manifest_cache)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(str(len(paths) - len(failed)) + " of " + str(len(paths)) + " manifests solved", file=sys.stderr)
+    return 1 if len(failed) != 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
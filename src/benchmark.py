@@ -0,0 +1,192 @@
+import numpy as np
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import time
+import algorithm
+import manifest
+
+# Benchmark of the balance solvers.
+# Runs a solver on every manifest in data/ and advanced_data/ plus seeded synthetic manifests of
+# increasing crate counts, and writes wall time, nodes expanded/generated, nodes/sec, peak RSS and
+# plan cost per manifest to a json results file.
+# Given a baseline results file it flags every manifest that got slower, expanded more nodes or
+# found a more expensive plan, and exits with status 1 if there were any.
+#
+# run from the project folder:
+#   python ./src/benchmark.py                                   (results go to benchmark_results.json)
+#   python ./src/benchmark.py --baseline benchmark_baseline.json
+#   python ./src/benchmark.py --output benchmark_baseline.json   (save a new baseline)
+#   python ./src/benchmark.py --bay 16x24 --sizes 6 10 14        (synthetic manifests of a larger bay only)
+#   python ./src/benchmark.py --solver a_star_heap --baseline benchmark_results.json
+#                                                                (the heap open list against the bucket queue)
+
+MANIFESTS = ['./data/ShipCase*.txt', './advanced_data/RowCase*.txt']
+SYNTHETIC_CRATES = (4, 8, 12, 16, 20)
+SYNTHETIC_SEED = 179
+SOLVERS = {
+    'a_star': (algorithm.a_star, {}),
+    'a_star_heap': (algorithm.a_star, {'open_list': 'heap'}), # to compare the bucket queue against a plain heap
+    'anytime': (algorithm.anytime_a_star, {}),
+    'ida_star': (algorithm.ida_star, {}),
+    'beam': (algorithm.beam_search, {}),
+}
+# how much slower than the baseline a manifest may get before it counts as a regression,
+# differences under TIME_FLOOR seconds are timer noise and never count
+TIME_TOLERANCE = 1.25
+TIME_FLOOR = 0.05
+
+# input: number of crates, a seed and the size of the bay
+# output: lines of a random rows x cols manifest with the crates stacked in their columns, most of them on port
+#         so there is something to balance. The two corner cells of the bottom row are NAN like the sample ships.
+def synthetic_manifest(crates, seed, rows=8, cols=12):
+    rng = np.random.default_rng(seed)
+    heights = np.zeros(cols, dtype=int)
+    heights[[0, cols - 1]] = 1 # the NAN corners
+    cells = {}
+    for i in range(crates):
+        open_cols = np.nonzero(heights < rows)[0]
+        port = open_cols[open_cols < cols//2]
+        choices = port if len(port) != 0 and rng.random() < 0.75 else open_cols
+        x = rng.choice(choices)
+        heights[x] += 1
+        cells[(heights[x], x + 1)] = (int(rng.integers(1, 10000)), "Crate" + str(i + 1))
+
+    lines = []
+    for y in range(1, rows + 1):
+        for x in range(1, cols + 1):
+            if y == 1 and (x == 1 or x == cols):
+                weight, label = 0, "NAN"
+            else:
+                weight, label = cells.get((y, x), (0, "UNUSED"))
+            lines.append("[" + str(y).zfill(2) + "," + str(x).zfill(2) + "], {" + str(weight).zfill(5) + "}, " + label)
+    return lines
+
+# output: list of (name, parsed manifest) for every benchmark case
+#         bay = (rows, cols) of the synthetic manifests, the sample ships are only included for the 8x12 bay
+def benchmark_cases(sizes=SYNTHETIC_CRATES, seed=SYNTHETIC_SEED, bay=(8, 12)):
+    cases = []
+    if bay == (8, 12):
+        for pattern in MANIFESTS:
+            for path in sorted(glob.glob(pattern)):
+                cases.append((os.path.basename(path).split(".")[0], manifest.load(path)[0]))
+        prefix = "Synthetic"
+    else:
+        prefix = "Synthetic" + str(bay[0]) + "x" + str(bay[1]) + "_"
+    for crates in sizes:
+        cases.append((prefix + str(crates), manifest.parse(synthetic_manifest(crates, seed + crates, bay[0], bay[1]))[0]))
+    return cases
+
+# runs in its own process so the peak RSS belongs to this manifest only
+def run_case(solver, X, results):
+    function, kwargs = SOLVERS[solver]
+    stats = {}
+    begin = time.perf_counter()
+    plan = function(X, stats=stats, **kwargs)
+    seconds = time.perf_counter() - begin
+    expanded = stats.get('expanded', 0)
+    results.put({
+        'seconds': seconds,
+        'expanded': expanded,
+        'generated': stats.get('generated', 0),
+        'nodes_per_second': expanded/seconds if seconds > 0 else 0,
+        'peak_rss_kb': algorithm.peak_rss_kb(),
+        'cost': int(plan[1]) if plan is not None else None,
+        'steps': len(plan[0]) if plan is not None else None,
+    })
+
+# input: solver name, parsed manifest, timeout in seconds and how many times to repeat it
+# output: the measurements of the fastest repeat, or {'failed': reason} if a run took longer than timeout
+#         or died (e.g. ran out of memory)
+def measure(solver, X, timeout=None, repeat=1):
+    best = None
+    for _ in range(repeat):
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=run_case, args=(solver, X, results), daemon=True)
+        worker.start()
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        result = None
+        while result is None:
+            try:
+                result = results.get(timeout=0.5)
+            except queue.Empty:
+                if not worker.is_alive() and results.empty():
+                    result = {'failed': 'exit code ' + str(worker.exitcode)}
+                elif deadline is not None and time.perf_counter() > deadline:
+                    result = {'failed': 'timed out'}
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+        if 'failed' in result:
+            return result
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+# input: results and baseline (both 'cases' dictionaries of a results file)
+# output: a list of messages, one per regression
+def regressions(results, baseline, time_tolerance=TIME_TOLERANCE, time_floor=TIME_FLOOR):
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if 'failed' in result and 'failed' not in base:
+            found.append(name + ": " + result['failed'] + ", the baseline finished in " + str(round(base['seconds'], 3)) + " s")
+            continue
+        if 'failed' in result or 'failed' in base:
+            continue
+        if result['seconds'] > base['seconds']*time_tolerance and result['seconds'] - base['seconds'] > time_floor:
+            found.append(name + ": " + str(round(result['seconds'], 3)) + " s, baseline " + str(round(base['seconds'], 3)) + " s")
+        if result['expanded'] > base['expanded']:
+            found.append(name + ": expanded " + str(result['expanded']) + " nodes, baseline " + str(base['expanded']))
+        if base['cost'] is not None and (result['cost'] is None or result['cost'] > base['cost']):
+            found.append(name + ": plan costs " + str(result['cost']) + " minutes, baseline " + str(base['cost']))
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the balance solvers.")
+    parser.add_argument('--solver', default='a_star', choices=sorted(SOLVERS))
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help="results file to compare against")
+    parser.add_argument('--sizes', default=SYNTHETIC_CRATES, type=int, nargs='*', help="crate counts of the synthetic manifests")
+    parser.add_argument('--seed', default=SYNTHETIC_SEED, type=int)
+    parser.add_argument('--bay', default='8x12', help="rows x cols of the synthetic manifests, e.g. 16x24")
+    parser.add_argument('--timeout', default=120, type=float, help="seconds per manifest")
+    parser.add_argument('--repeat', default=1, type=int, help="runs per manifest, the fastest is kept")
+    parser.add_argument('--time-tolerance', default=TIME_TOLERANCE, type=float)
+    args = parser.parse_args(argv)
+    bay = tuple(int(size) for size in args.bay.lower().split("x"))
+
+    results = {}
+    for name, X in benchmark_cases(args.sizes, args.seed, bay):
+        result = measure(args.solver, X, args.timeout, args.repeat)
+        results[name] = result
+        if 'failed' in result:
+            print(name.ljust(14), result['failed'])
+        else:
+            print(name.ljust(14), str(round(result['seconds'], 3)).rjust(9), "s", str(result['expanded']).rjust(8), "expanded",
+                  str(int(result['nodes_per_second'])).rjust(8), "nodes/s", str(result['cost']).rjust(4), "minutes", flush=True)
+
+    with open(args.output, "w") as file:
+        json.dump({'solver': args.solver, 'seed': args.seed, 'bay': args.bay, 'python': platform.python_version(),
+                   'numpy': np.__version__, 'machine': platform.machine(), 'cases': results}, file, indent=2)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    found = regressions(results, baseline['cases'], args.time_tolerance)
+    for message in found:
+        print("REGRESSION", message)
+    if len(found) == 0:
+        print("no regressions against", args.baseline)
+    return 1 if len(found) != 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
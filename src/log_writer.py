@@ -0,0 +1,98 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+# Writing the operator logs off the request path.
+# write() only puts the line on a bounded queue; one background thread takes the lines off it and appends
+# them to their files through handles it keeps open, one per log file, so a request never waits on the disk
+# unless the queue is full. Past max_handles the least recently used handle is closed, it is opened again
+# the next time its file gets a line.
+#   flush = 'line' to flush every line to the OS right away, 'idle' to flush once the queue runs empty
+#   fsync = True to also fsync on every one of those flushes, otherwise only flush() waits for the disk
+# flush(path) blocks until every line written to path so far is on disk, e.g. before the file is served.
+class LogWriter:
+    def __init__(self, max_queue=1024, max_handles=64, flush='idle', fsync=False):
+        if flush not in ('line', 'idle'):
+            raise ValueError("unknown log flush policy " + flush)
+        self.queue = queue.Queue(maxsize=max_queue) # (kind, path, text or event)
+        self.handles = OrderedDict() # path -> open file, least recently used first
+        self.dirty = set() # paths with lines that were not flushed yet
+        self.errors = {} # path -> the last error writing it, raised by flush()
+        self.max_handles = max_handles
+        self.flush_policy = flush
+        self.fsync = fsync
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # appends text (already a whole line) to the file at path
+    def write(self, path, text):
+        self.queue.put(('write', path, text))
+
+    # blocks until everything written to path so far is on disk
+    def flush(self, path):
+        done = threading.Event()
+        self.queue.put(('flush', path, done))
+        done.wait()
+        error = self.errors.pop(path, None)
+        if error is not None:
+            raise error
+
+    # flushes every file, closes the handles and stops the thread
+    def stop(self):
+        if self.thread.is_alive():
+            self.queue.put(('stop', None, None))
+            self.thread.join()
+
+    def handle(self, path):
+        file = self.handles.pop(path, None)
+        if file is None:
+            file = open(path, "a")
+        self.handles[path] = file
+        while len(self.handles) > self.max_handles:
+            old_path, old_file = self.handles.popitem(last=False)
+            # fsync now, flush() can't reach the file once its handle is closed
+            self.sync(old_path, old_file, True)
+            old_file.close()
+        return file
+
+    def sync(self, path, file, durable):
+        if path in self.dirty:
+            file.flush()
+            self.dirty.discard(path)
+        if durable:
+            os.fsync(file.fileno())
+
+    def run(self):
+        while True:
+            kind, path, payload = self.queue.get()
+            try:
+                if kind == 'stop':
+                    for old_path, file in self.handles.items():
+                        self.sync(old_path, file, True)
+                        file.close()
+                    self.handles.clear()
+                    return
+                if kind == 'write':
+                    file = self.handle(path)
+                    file.write(payload)
+                    self.dirty.add(path)
+                    if self.flush_policy == 'line':
+                        self.sync(path, file, self.fsync)
+                elif kind == 'flush' and path in self.handles:
+                    self.sync(path, self.handles[path], True)
+            except OSError as error:
+                self.errors[path] = error
+                self.dirty.discard(path)
+            finally:
+                if kind == 'flush':
+                    payload.set()
+
+            # nothing else to write right now, so this is a good time to hand the lines to the OS
+            if self.flush_policy == 'idle' and self.queue.empty():
+                for old_path in list(self.dirty):
+                    try:
+                        self.sync(old_path, self.handles[old_path], self.fsync)
+                    except OSError as error:
+                        self.errors[old_path] = error
+                        self.dirty.discard(old_path)
@@ -0,0 +1,169 @@
+import numpy as np
+import hashlib
+import io
+import mmap
+import os
+import re
+import sys
+import tempfile
+
+# Reading manifests.
+# Every line of a manifest is fixed width up to the label: "[yy,xx], {wwwww}, label".
+# parse() reads them in one pass into a typed structured array with one row per cell, in file order:
+#   'y', 'x' = int8 coordinates, 'weight' = int32 weight, 'label' = int16 code into the labels list.
+# Labels are interned, so equal labels share one string, and the codes of NAN and UNUSED are fixed
+# so cells can be told apart without looking at the labels at all.
+NAN = 0
+UNUSED = 1
+CELL_DTYPE = np.dtype([('y', np.int8), ('x', np.int8), ('weight', np.int32), ('label', np.int16)])
+LINE = re.compile(r"\[(\d{2}),(\d{2})\], \{(\d{5})\}, (.*\S)\s*$")
+
+# input: the lines of a manifest file
+# output: (cells, labels) where cells is a CELL_DTYPE array and labels[cells['label'][i]] is the label of cell i
+def parse(lines):
+    labels = ['NAN', 'UNUSED']
+    codes = {'NAN': NAN, 'UNUSED': UNUSED}
+    rows = []
+    for number, line in enumerate(lines, start=1):
+        if line.strip() == '':
+            continue
+        match = LINE.match(line)
+        if match is None:
+            raise ValueError("manifest line " + str(number) + " is not in the format [yy,xx], {wwwww}, label: " + line.rstrip())
+        y, x, weight, label = match.groups()
+        if label not in codes:
+            codes[label] = len(labels)
+            labels.append(sys.intern(label))
+        rows.append((int(y), int(x), int(weight), codes[label]))
+    return np.array(rows, dtype=CELL_DTYPE), labels
+
+# input: path of a manifest file, and optionally a folder to keep parsed copies in
+# output: (cells, labels) like parse()
+# With a cache folder the parsed cells are saved there as a .npy file next to a .labels file, and later loads
+# of the same unchanged file memory map them read only instead of parsing the text again.
+def load(path, cache_dir=None):
+    if cache_dir is None:
+        with open(path) as file:
+            return parse(file)
+
+    # a changed file gets a new entry since its size or modification time changes
+    stat = os.stat(path)
+    key = hashlib.sha1((os.path.abspath(path) + "|" + str(stat.st_size) + "|" + str(stat.st_mtime_ns)).encode()).hexdigest()
+    cells_path = os.path.join(cache_dir, key + ".npy")
+    labels_path = os.path.join(cache_dir, key + ".labels")
+    if os.path.exists(cells_path) and os.path.exists(labels_path):
+        with open(labels_path) as file:
+            labels = file.read().split("\n")
+        return np.load(cells_path, mmap_mode='r'), labels
+
+    with open(path) as file:
+        cells, labels = parse(file)
+    os.makedirs(cache_dir, exist_ok=True)
+    # written under a temporary name and moved into place, so a load running next to this one (e.g. another
+    # batch worker) never reads half an entry. The labels go first since an entry counts once the .npy is there.
+    replace_with(labels_path, "\n".join(labels).encode())
+    data = io.BytesIO()
+    np.save(data, cells)
+    replace_with(cells_path, data.getvalue())
+    return cells, labels
+
+# writes data to a temporary file next to path and moves it over path in one step
+def replace_with(path, data):
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", delete=False) as file:
+        file.write(data)
+    os.replace(file.name, path)
+
+# input: cells and labels like parse() returns
+# output: the all string array the web app shows: columns "yy", "xx", "wwwww", label
+def to_strings(cells, labels):
+    return np.column_stack((np.char.zfill(cells['y'].astype(str), 2),
+                            np.char.zfill(cells['x'].astype(str), 2),
+                            np.char.zfill(cells['weight'].astype(str), 5),
+                            np.array(labels, dtype=object)[cells['label']].astype(str)))
+
+# input: the all string array to_strings returns
+# output: (cells, labels) like parse() returns
+def from_strings(X):
+    labels = ['NAN', 'UNUSED']
+    codes = {'NAN': NAN, 'UNUSED': UNUSED}
+    for label in X[:, 3]:
+        if label not in codes:
+            codes[label] = len(labels)
+            labels.append(sys.intern(str(label)))
+    cells = np.empty(X.shape[0], dtype=CELL_DTYPE)
+    cells['y'], cells['x'], cells['weight'] = X[:, 0].astype(int), X[:, 1].astype(int), X[:, 2].astype(int)
+    cells['label'] = [codes[label] for label in X[:, 3]]
+    return cells, labels
+
+# input: a record of the manifest as (y, x, weight, label)
+# output: its line without the newline
+def format_record(record):
+    y, x, weight, label = record
+    return "[" + str(y).zfill(2) + "," + str(x).zfill(2) + "], {" + str(weight).zfill(5) + "}, " + label
+
+# input: cells and labels like parse() returns
+# output: the lines of the manifest file
+def format_lines(cells, labels):
+    return [format_record((y, x, weight, labels[label])) + "\n" for y, x, weight, label in cells.tolist()]
+
+# writes the manifest to path as plain lines, the form that goes to the ship
+def write_lines(path, cells, labels):
+    with open(path, "w") as file:
+        file.writelines(format_lines(cells, labels))
+
+# Updating an outbound manifest in place.
+# write_records() writes every line padded to the same number of bytes (labels get trailing spaces, which
+# parse() drops), so record i always sits at byte i*width and a crate move only rewrites the two records it
+# touches through a memory map instead of the whole file.
+# The padding is only for us: unpadded() gives the plain manifest for anyone else, and unpad_records()
+# turns the file into one once it won't be patched anymore.
+
+# input: a record of the manifest as (y, x, weight, label) and the record width in bytes
+# output: the record as bytes, padded to width
+def encode_record(record, width):
+    line = format_record(record).encode()
+    if len(line) + 1 > width:
+        raise ValueError("manifest record is longer than " + str(width) + " bytes: " + line.decode())
+    return line.ljust(width - 1) + b"\n"
+
+# writes the manifest to path with fixed width records
+# output: the record width in bytes, needed to patch the file later
+def write_records(path, cells, labels):
+    records = [(y, x, weight, labels[label]) for y, x, weight, label in cells.tolist()]
+    width = max(len(format_record(record).encode()) for record in records) + 1
+    with open(path, "wb") as file:
+        file.write(b"".join(encode_record(record, width) for record in records))
+    return width
+
+# input: path and record width of a file from write_records, and {record index: (y, x, weight, label)}
+# Overwrites just those records. With durable=True they are flushed to disk before it returns,
+# otherwise they only reach the page cache (other readers see them right away) until sync() is called.
+def patch_records(path, width, records, durable=True):
+    with open(path, "r+b") as file, mmap.mmap(file.fileno(), 0) as view:
+        for index, record in records.items():
+            view[index*width:(index + 1)*width] = encode_record(record, width)
+        if durable:
+            view.flush()
+
+# flushes every patch made to path so far to disk
+def sync(path):
+    with open(path, "rb") as file:
+        os.fsync(file.fileno())
+
+# input: path of a file from write_records
+# output: its contents as a plain manifest, the padding taken off every line
+def unpadded(path):
+    with open(path, "rb") as file:
+        return b"".join(line.rstrip(b" \n") + b"\n" for line in file)
+
+# rewrites the file at path from write_records as a plain manifest and flushes it to disk.
+# It can't be patched anymore afterwards. Calling it again on the plain manifest changes nothing.
+def unpad_records(path):
+    data = unpadded(path)
+    with open(path, "rb") as file:
+        if file.read() == data:
+            return # already plain, don't truncate it under someone reading it
+    with open(path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
@@ -0,0 +1,155 @@
+import numpy as np
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import manifest
+
+# Where app.py keeps its per session ship dictionaries and solve jobs.
+# Both stores below act like a dict of key -> dictionary, but hand out copies: a changed value has
+# to be stored again with store[key] = value. Values are kept packed: the string grid becomes the
+# typed cells of manifest.parse plus a color code per cell, steps and costs become small int arrays.
+# Entries not used for ttl seconds are dropped, and past max_entries the least recently used ones go.
+#   MemoryStore = inside this process only
+#   SQLiteStore = a SQLite file, so several worker processes can serve the same sessions
+COLORS = ['', 'green', 'red']
+
+# input: a ship or job dictionary
+# output: bytes of its compact form
+def pack(value):
+    value = dict(value)
+    if 'grid' in value:
+        grid = value.pop('grid')
+        value['cells'], value['labels'] = manifest.from_strings(grid[:, 0:4])
+        value['colors'] = np.array([COLORS.index(color) for color in grid[:, 4]], dtype=np.int8)
+    if 'steps' in value and len(value['steps']) != 0:
+        value['steps'] = np.asarray(value['steps']).astype(np.int16)
+    if 'costs' in value and len(value['costs']) != 0:
+        value['costs'] = np.asarray(value['costs']).astype(np.int32)
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+# input: bytes from pack()
+# output: the dictionary as it was packed
+def unpack(data):
+    value = pickle.loads(data)
+    if 'cells' in value:
+        grid = manifest.to_strings(value.pop('cells'), value.pop('labels'))
+        colors = np.array(COLORS, dtype=object)[value.pop('colors')]
+        value['grid'] = np.column_stack((grid.astype(object), colors)).astype(str)
+    return value
+
+class MemoryStore:
+    def __init__(self, max_entries=64, ttl=12*60*60):
+        self.entries = OrderedDict() # key -> (last used, packed value), least recently used first
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock() # the solve jobs write from their own threads
+
+    def evict(self, now):
+        while len(self.entries) != 0:
+            key, (last_used, _) = next(iter(self.entries.items()))
+            if len(self.entries) <= self.max_entries and now - last_used <= self.ttl:
+                break
+            del self.entries[key]
+
+    def __getitem__(self, key):
+        with self.lock:
+            now = time.time()
+            self.evict(now)
+            _, data = self.entries.pop(key)
+            self.entries[key] = (now, data)
+        return unpack(data)
+
+    def __setitem__(self, key, value):
+        data = pack(value)
+        with self.lock:
+            now = time.time()
+            self.entries.pop(key, None)
+            self.entries[key] = (now, data)
+            self.evict(now)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.entries[key]
+
+    def __contains__(self, key):
+        with self.lock:
+            self.evict(time.time())
+            return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+class SQLiteStore:
+    def __init__(self, path, table, max_entries=64, ttl=12*60*60):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        folder = os.path.dirname(path)
+        if folder != '':
+            os.makedirs(folder, exist_ok=True)
+        with self.connect() as connection:
+            # write ahead logging lets the other workers keep reading while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS " + table + " (key TEXT PRIMARY KEY, value BLOB, last_used REAL)")
+        connection.close()
+
+    # one connection per call since the store is used from several threads
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def evict(self, connection, now):
+        connection.execute("DELETE FROM " + self.table + " WHERE last_used < ?", (now - self.ttl,))
+        connection.execute("DELETE FROM " + self.table + " WHERE key NOT IN "
+                           "(SELECT key FROM " + self.table + " ORDER BY last_used DESC LIMIT ?)", (self.max_entries,))
+
+    def __getitem__(self, key):
+        with self.connect() as connection:
+            now = time.time()
+            row = connection.execute("SELECT value, last_used FROM " + self.table + " WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                connection.execute("UPDATE " + self.table + " SET last_used = ? WHERE key = ?", (now, key))
+        connection.close()
+        if row is None or now - row[1] > self.ttl:
+            raise KeyError(key)
+        return unpack(row[0])
+
+    def __setitem__(self, key, value):
+        data = pack(value)
+        with self.connect() as connection:
+            now = time.time()
+            connection.execute("INSERT OR REPLACE INTO " + self.table + " VALUES (?, ?, ?)", (key, data, now))
+            self.evict(connection, now)
+        connection.close()
+
+    def __delitem__(self, key):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM " + self.table + " WHERE key = ?", (key,))
+        connection.close()
+
+    def __contains__(self, key):
+        with self.connect() as connection:
+            row = connection.execute("SELECT last_used FROM " + self.table + " WHERE key = ?", (key,)).fetchone()
+        connection.close()
+        return row is not None and time.time() - row[0] <= self.ttl
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+# input: 'memory' or 'sqlite', the table (also the name of the store), and for sqlite the database file
+# output: a store
+def open_store(backend, table, path='./cache/sessions.sqlite3', max_entries=64, ttl=12*60*60):
+    if backend == 'memory':
+        return MemoryStore(max_entries, ttl)
+    if backend == 'sqlite':
+        return SQLiteStore(path, table, max_entries, ttl)
+    raise ValueError("unknown session store backend " + backend)
@@ -0,0 +1,66 @@
+import numpy as np
+import sqlite3
+import hashlib
+import json
+import os
+import time
+import algorithm
+
+# Plans solved so far, kept across restarts of the app.
+# A plan only depends on where each weight sits and which cells are NAN, not on the crate labels,
+# so manifests that only differ in labels share an entry.
+# Only plans proven optimal are stored, a hit is shown instead of solving again so it has to be as good.
+# The least recently used entries are dropped once there are more than MAX_ENTRIES.
+CACHE_PATH = './cache/solutions.sqlite3'
+MAX_ENTRIES = 1000
+
+# input: the parsed manifest (either kind algorithm.manifest_arrays takes) and the name of the solver that produced the plan
+# output: a hex string that is the same for every manifest with the same weight layout
+def fingerprint(X, solver):
+    w, is_crate, nan = algorithm.manifest_arrays(X)
+    cells = []
+    for (y, x, weight), crate, blocked in zip(w.tolist(), is_crate.tolist(), nan.tolist()):
+        if crate:
+            content = str(weight)
+        else:
+            content = 'NAN' if blocked else 'UNUSED'
+        cells.append(str(y) + "," + str(x) + ":" + content)
+    return hashlib.sha256((solver + "|" + ";".join(cells)).encode()).hexdigest()
+
+def connect(path=CACHE_PATH):
+    folder = os.path.dirname(path)
+    if folder != '':
+        os.makedirs(folder, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS solutions ("
+                       "fingerprint TEXT PRIMARY KEY, steps TEXT, total_cost INTEGER, costs TEXT, last_used REAL)")
+    return connection
+
+# input: a fingerprint
+# output: (steps, total_cost, costs) in the same form algorithm.a_star returns them, or None if it was never solved
+def get(key, path=CACHE_PATH):
+    connection = connect(path)
+    try:
+        with connection:
+            row = connection.execute("SELECT steps, total_cost, costs FROM solutions WHERE fingerprint = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE solutions SET last_used = ? WHERE fingerprint = ?", (time.time(), key))
+    finally:
+        connection.close()
+
+    steps, total_cost, costs = json.loads(row[0]), row[1], json.loads(row[2])
+    # an already balanced ship has no steps at all
+    if len(steps) == 0:
+        return np.array([]), total_cost, np.array([])
+    return np.array(steps, dtype=np.int64), total_cost, np.array(costs, dtype=np.int64)
+
+# stores a plan under key and evicts the least recently used plans past max_entries
+def put(key, steps, total_cost, costs, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+    with connect(path) as connection:
+        connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?)",
+                           (key, json.dumps(np.asarray(steps).tolist()), int(total_cost),
+                            json.dumps(np.asarray(costs).tolist()), time.time()))
+        connection.execute("DELETE FROM solutions WHERE fingerprint NOT IN "
+                           "(SELECT fingerprint FROM solutions ORDER BY last_used DESC LIMIT ?)", (max_entries,))
+    connection.close()
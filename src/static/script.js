@@ -1,9 +1,15 @@
 let stepHistory = [];
+let planReady = false;
+// the grid as of the last snapshot or delta, patched locally on every step
+let gridState = null;
+// steps that were drawn already and wait to be sent to the server, one request at a time in order
+let pendingSteps = [];
+let sendingSteps = false;
 
 document.addEventListener('DOMContentLoaded', () => {
     // If we're on the grid page (has ship-grid), initialize grid handlers
     if (document.getElementById('ship-grid')) {
-        fetchGridState();
+        waitForPlan(document.body.dataset.jobId).then(fetchGridState);
         document.addEventListener('keydown', (e) => {
             if (e.key === 'Enter') {
                 nextStep();
@@ -60,10 +66,58 @@ function initStartPage() {
     });
 }
 
+// poll the solve job of this page until the plan is ready
+async function waitForPlan(jobId) {
+    const statusText = document.getElementById('status-text');
+    const progress = jobId ? showSearchProgress(jobId) : null;
+    while (jobId) {
+        try {
+            const response = await fetch(`/api/job/${jobId}`);
+            const job = await response.json();
+            if (job.status === 'done') {
+                break;
+            }
+            if (job.status === 'failed') {
+                statusText.innerText = `Could not balance the ship: ${job.error}`;
+                statusText.style.color = "#e74c3c";
+                return new Promise(() => {}); // never load the grid
+            }
+            statusText.innerText = job.status === 'queued' ? "Waiting for a solver..." : "Finding a balance plan...";
+        } catch (error) {
+            console.error("Error checking job:", error);
+        }
+        await new Promise(resolve => setTimeout(resolve, 500));
+    }
+    if (progress) {
+        progress.close();
+    }
+    document.getElementById('search-progress').innerText = '';
+    planReady = true;
+}
+
+// show the live search counters streamed by the server while the plan is being found
+function showSearchProgress(jobId) {
+    const progressText = document.getElementById('search-progress');
+    const source = new EventSource(`/api/job/${jobId}/progress`);
+    source.onmessage = (event) => {
+        const report = JSON.parse(event.data).progress;
+        if (!report) 
+            return;
+        let message = `${report.expanded} nodes expanded, ${report.open} queued, best f ${report.best_f}, best imbalance ${report.best_imbalance}, ${report.seconds.toFixed(1)} s`;
+        if (report.plan_cost !== null) {
+            message += ` (a plan of ${report.plan_cost} move minutes is ready)`;
+        }
+        progressText.innerText = message;
+    };
+    source.addEventListener('end', () => source.close());
+    return source;
+}
+
 async function fetchGridState() {
     try {
         const response = await fetch('/api/current_grid');
         const data = await response.json(); //data is the main way to get all the info about the grid
+        gridState = data;
         renderSystem(data);
         StepHistory(data);
         const timeElement = document.getElementById('time-display');
@@ -75,16 +129,89 @@ async function fetchGridState() {
     }
 }
 
+// patch the local grid with a delta from predictDelta and redraw it
+function applyDelta(delta) {
+    delta.cells.forEach(([row, ...cell]) => {
+        gridState.grid[row] = cell;
+    });
+    gridState.park_cell = delta.park_cell;
+    gridState.current_step_num = delta.current_step_num;
+    gridState.all_done = delta.all_done;
+    gridState.version = delta.version;
+    StepHistory(gridState);
+    renderSystem(gridState);
+}
+
+// work out the delta of the next step from the frames of the snapshot, the same way the server does,
+// so the grid can be redrawn before the server answers
+function predictDelta(state) {
+    const step = state.current_step_num;
+    const [source, target, moves] = state.frames[step];
+    const delta = { version: state.version + 1, park_cell: state.park_cell, current_step_num: step, all_done: false };
+    const changed = {};
+    const paint = (row, color) => {
+        if (row < 0) {
+            delta.park_cell = color;
+            return;
+        }
+        if (!changed[row])
+            changed[row] = state.grid[row].slice();
+        changed[row][4] = color;
+    };
+
+    paint(source, '');
+    paint(target, '');
+    if (step >= state.num_steps - 1) {
+        delta.all_done = true;
+    } else {
+        if (moves) {
+            // swap the weight and name but not the coordinates
+            const moved = changed[source].slice(2, 4);
+            changed[source].splice(2, 2, ...changed[target].slice(2, 4));
+            changed[target].splice(2, 2, ...moved);
+        }
+        delta.current_step_num = step + 1;
+        const [nextSource, nextTarget] = state.frames[step + 1];
+        paint(nextSource, 'green');
+        paint(nextTarget, 'red');
+    }
+    delta.cells = Object.entries(changed).map(([row, cell]) => [Number(row), ...cell]);
+    return delta;
+}
+
+// true if the server's delta is the one we predicted (the changed cells may come in any order)
+function sameDelta(delta, predicted) {
+    const key = (d) => JSON.stringify([d.version, d.park_cell, d.current_step_num, d.all_done,
+                                       [...d.cells].sort((a, b) => a[0] - b[0])]);
+    return key(delta) === key(predicted);
+}
+
 async function nextStep() {
-    try {
-        const response = await fetch('/api/next_grid', { method: 'POST' });
-        const data = await response.json();
-        
-        StepHistory(data);
-        renderSystem(data);
-    } catch (error) {
-        console.error("Error advancing step:", error);
+    if (!planReady || !gridState || gridState.all_done)
+        return;
+    const predicted = predictDelta(gridState);
+    applyDelta(predicted);
+    pendingSteps.push(predicted);
+    if (sendingSteps)
+        return; // the loop below sends it after the steps before it
+
+    sendingSteps = true;
+    while (pendingSteps.length > 0) {
+        const expected = pendingSteps.shift();
+        try {
+            const response = await fetch('/api/next_grid', { method: 'POST' });
+            const delta = await response.json();
+            if (!response.ok || !sameDelta(delta, expected)) {
+                throw new Error(`the server answered version ${delta.version}, expected ${expected.version}`);
+            }
+        } catch (error) {
+            console.error("Error advancing step:", error);
+            // the page no longer shows what the server has, start again from its snapshot
+            pendingSteps = [];
+            await fetchGridState();
+        }
     }
+    sendingSteps = false;
 }
 
 function renderStepLog() {